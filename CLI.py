@@ -1,7 +1,11 @@
 import argparse
+import sys
 from pathlib import Path
-from engine import Engine, DirInfo, FileInfo
-from collections import deque
+from engine import Engine, is_standard_stream
+from byte_level_algorithms.file_handler import WritingLimitError
+from profiling import Profiler
+from byte_level_algorithms.central_directory import CentralDirectory, DirectoryEntry, MembersNotFoundError
+from core_algorithms.LZ77_core import DEFAULT_MAX_CHAIN_LENGTH, PARSE_STRATEGIES, DEFAULT_PARSE
 
 
 class ConsoleInterface:
@@ -12,32 +16,85 @@ class ConsoleInterface:
         parser = self.init_parser()
         args = parser.parse_args()
         mode = args.mode
+        if mode != 'c' and (is_standard_stream(args.src) or is_standard_stream(args.destination)):
+            raise ValueError('- (stdin or stdout) can be used only in c mode')
+        # with archive going to stdout messages go to stderr
+        messages = sys.stdout
+        exit_code = 0
+        if is_standard_stream(args.destination) or (args.destination is None and is_standard_stream(args.src)):
+            messages = sys.stderr
 
         engine = Engine(src=self.resolve_path(args.src),
                         dst_folder=self.resolve_path(args.destination, is_dir=True),
                         password=args.password,
                         use_lz77=args.use_lz77,
-                        writing_limit_megabytes=args.writing_limit)
+                        writing_limit_megabytes=args.writing_limit,
+                        lz77_max_chain_length=args.lz77_max_chain,
+                        lz77_parse=args.lz77_parse,
+                        jobs=args.jobs,
+                        profiler=Profiler() if args.profile is not None else None)
         if mode == 'stat':
-            tree = engine.read_dir_tree()
-            self.pretty_print_tree(tree)
+            directory = engine.read_central_directory()
+            self.pretty_print_directory(directory)
         elif mode == 'c':
-            engine.compress()
-            print('compressed')
+            try:
+                engine.compress()
+                print('compressed', file=messages)
+            except WritingLimitError as e:
+                print(f'archive does not fit into writing limit (-wl), it is not complete: {e}', file=sys.stderr)
+                exit_code = 1
         elif mode == 'd':
             src_path = self.resolve_path(args.src)
             if src_path.suffix != Engine.compressed_file_extension:
                 print(
                     f'Wrong file warning!! selected file is not a {Engine.compressed_file_extension} file : {src_path}')
-            engine.decompress()
-            print('decompressed')
+            failed_count = self.print_failures(engine.decompress(), engine.dst_folder)
+            print('decompressed' if failed_count == 0 else f'decompressed, {failed_count} files failed')
+            exit_code = 1 if failed_count > 0 else 0
+        elif mode == 't':
+            results = engine.test()
+            failed_count = self.print_failures(results, engine.dst_folder)
+            tested_count = sum(file is not None for file, _ in results)
+            print(f'tested {tested_count} files, {failed_count} failed')
+            exit_code = 1 if failed_count > 0 else 0
+        elif mode == 'x':
+            if len(args.members) == 0:
+                raise ValueError('x mode needs at least one member pattern')
+            try:
+                results = engine.extract(args.members)
+            except MembersNotFoundError as e:
+                print(e, file=sys.stderr)
+                sys.exit(1)
+            failed_count = self.print_failures(results, engine.dst_folder)
+            print(f'extracted {len(results) - failed_count} files, {failed_count} failed')
+            exit_code = 1 if failed_count > 0 else 0
         else:
             raise ValueError(f'mode {mode} not supported')
+        if engine.profiler is not None:
+            engine.profiler.print_summary(messages)
+            engine.profiler.save_chrome_trace(args.profile)
+            print(f'trace saved to {args.profile}', file=messages)
+        if exit_code != 0:
+            sys.exit(exit_code)
         return
 
+    def print_failures(self, results, dst_folder):
+        """results: list of (FileInfo, error message or None), FileInfo None == whole archive
+        returns amount of failed"""
+        failed_count = 0
+        for file, error in results:
+            if error is None:
+                continue
+            name = 'archive' if file is None else file.path.relative_to(dst_folder).as_posix()
+            print(f'FAILED {name}: {error}')
+            failed_count += 1
+        return failed_count
+
     def resolve_path(self, input_path_str, is_dir=False):
         if input_path_str is None:
             return None
+        if is_standard_stream(input_path_str):
+            return input_path_str
         path = Path(input_path_str)
         if not path.is_absolute():
             path = Path(Path.cwd(), path)
@@ -51,38 +108,60 @@ class ConsoleInterface:
         parser = argparse.ArgumentParser(prog="defish",
                                          description="compress arbitrary data")
         parser.add_argument('src', type=str,
-                            help='file or folder path that will be the source')
-        parser.add_argument('mode', choices=['stat', 'c', 'd'],
+                            help='file or folder path that will be the source; '
+                                 '- == stdin (c mode only)')
+        parser.add_argument('mode', choices=['stat', 'c', 'd', 'x', 't'],
                             help='stat == show statistics'
                                  'c == compress'
-                                 'd == decompress')
+                                 'd == decompress'
+                                 'x == extract only selected files'
+                                 't == test: decode all files without writing them and check checksums')
+        parser.add_argument('members', nargs='*',
+                            help='for x mode: glob patterns of file paths inside archive, '
+                                 'like "subfolder/*.png"; * matches "/" too; '
+                                 'path of folder means all files in it; '
+                                 'pattern that matches no file is an error (exit code 1)')
         parser.add_argument('-wl', '--writing_limit', type=int,
                             help='limit on how much megabytes can be written to file;'
-                                 'to prevent unlimited writing to file in case if something goes wrong'
-                                 'default is 3')
+                                 'to prevent unlimited writing to file in case if something goes wrong; '
+                                 'archive that does not fit is not written and exit code is 1, '
+                                 'decompressed files that do not fit are FAILED and removed; '
+                                 'default is 3, no limit when archive goes to stdout')
         parser.add_argument('-dst', '--destination', type=str,
-                            help='destination path == where to put results')
+                            help='destination path == where to put results; '
+                                 '- == stdout (c mode only; default when source is stdin)')
         parser.add_argument('-psw', '--password', type=str)
-        parser.add_argument('--use_lz77', action='store_true', help='whether to use lz77 or not; my lz77 seems to be pretty slow and totally unproductive; thats pobably due to small window width (50 bytes) compared to standart 32Kb; bigger window, slower program; '
+        parser.add_argument('-j', '--jobs', type=int,
+                            help='how many processes compress, decompress or test files at the same time; '
+                                 'old archives with password are decompressed in one process; '
+                                 'default is 1')
+        parser.add_argument('--use_lz77', action='store_true', help='whether to use lz77 or not; '
+                                                                    'window width is 32 KB, matches are up to 258 bytes long; '
                                                                     'no need to specify this when decoding')
+        parser.add_argument('--lz77_max_chain', type=int,
+                            help='how many earlier positions lz77 checks for each match; '
+                                 'bigger is slower but compresses better; '
+                                 f'default is {DEFAULT_MAX_CHAIN_LENGTH}')
+        parser.add_argument('--lz77_parse', choices=PARSE_STRATEGIES,
+                            help='how lz77 chooses matches: '
+                                 'greedy == the longest match at once (fastest); '
+                                 'lazy, lazy2 == take a literal first if a match 1 or 2 bytes later is longer; '
+                                 'optimal == cheapest records of every 4 KB block (slowest, compresses best); '
+                                 f'default is {DEFAULT_PARSE}')
+        parser.add_argument('--profile', nargs='?', const='defish_trace.json', metavar='TRACE_FILE',
+                            help='measure time and bytes of every stage, print summary table '
+                                 'and save chrome trace (chrome://tracing, ui.perfetto.dev); '
+                                 'default trace file is defish_trace.json')
         return parser
 
-    def pretty_print_tree(self, tree):
-        queue = deque()
-        queue.append((tree, 0))
-        while len(queue) > 0:
-            cur_dir, level = queue.popleft()
-            cur_dir: DirInfo = cur_dir
-            print(self.get_file_record(cur_dir.name, level, None))
-            for f in cur_dir.files:
-                file: FileInfo = f
-                comp_ratio = None if (file.length_bytes is None
-                                      or file.initial_size is None
-                                      or file.initial_size == 0) \
-                    else file.length_bytes / file.initial_size
-                print(self.get_file_record(file.name, level+1, comp_ratio))
-            for d in cur_dir.dirs:
-                queue.append((d, level+1))
+    def pretty_print_directory(self, directory: CentralDirectory):
+        print(self.get_file_record(directory.root_name, 0, None))
+        for entry in directory:
+            entry: DirectoryEntry = entry
+            level = entry.path.count('/') + 1
+            comp_ratio = None if (entry.is_dir or entry.initial_size == 0) \
+                else entry.length_bytes / entry.initial_size
+            print(self.get_file_record(entry.name, level, comp_ratio))
         pass
 
     def get_file_record(self, name, level, compression_ratio, offset=50):
@@ -0,0 +1,120 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.datasets import get_datasets, DEFAULT_SYNTHETIC_SIZE
+from benchmarks.stages import STAGES
+
+
+class BenchmarkInterface:
+    """python -m benchmarks run -o results.json
+    python -m benchmarks compare old.json new.json"""
+    def __init__(self):
+        pass
+
+    def run(self):
+        args = self.init_parser().parse_args()
+        if args.command == 'run':
+            results = self.run_benchmarks(args.stages, args.datasets, args.repeats, args.synthetic_size)
+            self.print_results(results)
+            if args.output is not None:
+                Path(args.output).write_text(json.dumps(results, indent=2))
+        else:
+            regressions = self.compare(json.loads(Path(args.old).read_text()),
+                                       json.loads(Path(args.new).read_text()),
+                                       args.speed_threshold, args.ratio_threshold)
+            sys.exit(1 if regressions > 0 else 0)
+        pass
+
+    def init_parser(self):
+        parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                         description='speed and ratio of every stage of defish')
+        commands = parser.add_subparsers(dest='command', required=True)
+        run_parser = commands.add_parser('run', help='measure and save results to json')
+        run_parser.add_argument('-o', '--output', type=str, help='json file for results')
+        run_parser.add_argument('-s', '--stages', nargs='*', choices=list(STAGES),
+                                help='stages to measure; default is all')
+        run_parser.add_argument('-d', '--datasets', nargs='*',
+                                help='names of datasets (like "fish.bmp" or "synthetic/text"); default is all')
+        run_parser.add_argument('-r', '--repeats', type=int, default=3,
+                                help='best of how many runs is taken; default is 3')
+        run_parser.add_argument('--synthetic_size', type=int, default=DEFAULT_SYNTHETIC_SIZE,
+                                help=f'bytes in every synthetic dataset; default is {DEFAULT_SYNTHETIC_SIZE}')
+        compare_parser = commands.add_parser('compare', help='compare two json results, exit code 1 on regression')
+        compare_parser.add_argument('old', type=str)
+        compare_parser.add_argument('new', type=str)
+        compare_parser.add_argument('--speed_threshold', type=float, default=0.1,
+                                    help='slowdown that is a regression; default is 0.1 == 10%%')
+        compare_parser.add_argument('--ratio_threshold', type=float, default=0.005,
+                                    help='growth of compression ratio that is a regression; default is 0.005')
+        return parser
+
+    def run_benchmarks(self, stage_names, dataset_names, repeats, synthetic_size):
+        datasets = get_datasets(synthetic_size=synthetic_size)
+        if dataset_names:
+            datasets = {name: datasets[name] for name in dataset_names}
+        results = dict()
+        for stage_name in stage_names or STAGES:
+            for dataset_name, data in datasets.items():
+                results[f'{stage_name}:{dataset_name}'] = self.measure(STAGES[stage_name], data, repeats)
+                print('.', end='', flush=True, file=sys.stderr)
+        print(file=sys.stderr)
+        return {'info': {'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                         'python': platform.python_version(),
+                         'machine': platform.platform(),
+                         'repeats': repeats},
+                'results': results}
+
+    def measure(self, stage, data, repeats):
+        """best time of repeats runs"""
+        with tempfile.TemporaryDirectory() as work_folder:
+            run = stage(data, work_folder)
+            best_seconds = None
+            output_size = 0
+            for _ in range(repeats):
+                start = time.perf_counter()
+                output_size = run()
+                seconds = time.perf_counter() - start
+                best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+        return {'input_bytes': len(data),
+                'output_bytes': output_size,
+                'seconds': best_seconds,
+                'mb_per_s': len(data) / (1024 * 1024) / max(best_seconds, 1e-9),
+                'ratio': output_size / len(data) if len(data) > 0 else None}
+
+    def print_results(self, results):
+        print(f'{"stage:dataset":<60}{"MB/s":>10}{"ratio":>10}')
+        for name, result in results['results'].items():
+            ratio = '' if result['ratio'] is None else f'{result["ratio"]:.4f}'
+            print(f'{name:<60}{result["mb_per_s"]:>10.2f}{ratio:>10}')
+        pass
+
+    def compare(self, old, new, speed_threshold, ratio_threshold):
+        """prints changes of measurements present in both results; returns amount of regressions"""
+        regressions = 0
+        print(f'{"stage:dataset":<60}{"speed":>10}{"ratio":>10}')
+        for name, new_result in new['results'].items():
+            old_result = old['results'].get(name)
+            if old_result is None:
+                continue
+            speed_change = new_result['mb_per_s'] / old_result['mb_per_s'] - 1
+            ratio_change = 0
+            if old_result['ratio'] and new_result['ratio'] is not None:
+                ratio_change = new_result['ratio'] / old_result['ratio'] - 1
+            is_regression = speed_change < -speed_threshold or ratio_change > ratio_threshold
+            regressions += is_regression
+            print(f'{name:<60}{speed_change:>+10.1%}{ratio_change:>+10.2%}{"  REGRESSION" if is_regression else ""}')
+        print(f'{regressions} regressions')
+        return regressions
+    pass
+
+
+if __name__ == '__main__':
+    BenchmarkInterface().run()
@@ -0,0 +1,48 @@
+from pathlib import Path
+import random
+
+
+CORPUS_FOLDER = Path(__file__).parent.parent / 'data_files' / 'source_data'
+DEFAULT_SYNTHETIC_SIZE = 256 * 1024
+SEED = 2024
+
+
+def get_datasets(corpus_folder=CORPUS_FOLDER, synthetic_size=DEFAULT_SYNTHETIC_SIZE):
+    """name -> bytes; files of corpus and synthetic data made with fixed seed,
+    so every run measures the same input"""
+    datasets = dict()
+    for path in sorted(Path(corpus_folder).rglob('*')):
+        if path.is_file():
+            datasets[path.relative_to(corpus_folder).as_posix()] = path.read_bytes()
+    datasets['synthetic/text'] = make_text(synthetic_size)
+    datasets['synthetic/random'] = make_random(synthetic_size)
+    datasets['synthetic/runs'] = make_runs(synthetic_size)
+    return datasets
+
+
+def make_text(size):
+    """words of a small vocabulary with zipf-like frequencies"""
+    rand = random.Random(SEED)
+    vocabulary = [''.join(rand.choice('etaoinshrdlcumwfgypbvkjxqz') for _ in range(rand.randint(1, 9)))
+                  for _ in range(2000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    parts = []
+    length = 0
+    while length < size:
+        line = ' '.join(rand.choices(vocabulary, weights, k=12)) + '.\n'
+        parts.append(line)
+        length += len(line)
+    return ''.join(parts).encode()[:size]
+
+
+def make_random(size):
+    return random.Random(SEED).randbytes(size)
+
+
+def make_runs(size):
+    """runs of one byte, 1..200 long"""
+    rand = random.Random(SEED)
+    output = bytearray()
+    while len(output) < size:
+        output += bytes([rand.randrange(256)]) * rand.randint(1, 200)
+    return bytes(output[:size])
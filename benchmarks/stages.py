@@ -0,0 +1,161 @@
+from pathlib import Path
+import lzma
+import zlib
+from chunk_stream import DEFAULT_CHUNK_SIZE
+from byte_level_algorithms import file_handler
+from byte_level_algorithms.cypher_stream import CypherStream, KeystreamCypherStream
+from byte_level_algorithms.LZ77Record_to_bytes_converter import LZ77VarintRecordToBytesConverter
+from byte_level_algorithms.canonical_huffman_bytes_converters import CanonicalHuffmanBlockToBytesConverter, \
+    BytesToCanonicalHuffmanBlockConverter
+from core_algorithms.LZ77_core import LZ77EncoderCore, LZ77DecoderCore, DEFAULT_PARSE
+from core_algorithms.huffman_core import AdaptiveHuffmanEncoderCore, StoredBlock
+from engine import Engine
+
+
+# every stage takes input data and work folder, prepares what it needs
+# and returns a function that runs the stage once and returns output size;
+# only that function is timed
+
+
+def split_to_chunks(data, chunk_size=DEFAULT_CHUNK_SIZE):
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def count_bytes(chunks):
+    return sum(len(chunk) for chunk in chunks)
+
+
+def make_huffman_encoder():
+    return AdaptiveHuffmanEncoderCore(Engine.huffman_segment_length,
+                                      max_block_length=Engine.huffman_max_block_length)
+
+
+def make_lz77_encoder(parse=DEFAULT_PARSE):
+    return LZ77EncoderCore(Engine.lz77_window_width, Engine.lz77_max_length, parse=parse)
+
+
+def read_file_stage(data, work_folder):
+    path = Path(work_folder, 'input')
+    path.write_bytes(data)
+    return lambda: count_bytes(file_handler.read_file_stream(path))
+
+
+def write_file_stage(data, work_folder):
+    path = Path(work_folder, 'output')
+    chunks = split_to_chunks(data)
+
+    def run():
+        file_handler.write_to_file_limited(path, chunks, len(data))
+        return path.stat().st_size
+    return run
+
+
+def legacy_cypher_stage(data, work_folder):
+    chunks = split_to_chunks(data)
+    return lambda: count_bytes(CypherStream(b'key').encode(chunks))
+
+
+def keystream_cypher_stage(data, work_folder):
+    chunks = split_to_chunks(data)
+    return lambda: count_bytes(KeystreamCypherStream(b'key').encode(chunks))
+
+
+def lz77_encoder_stage(data, work_folder, parse=DEFAULT_PARSE):
+    chunks = split_to_chunks(data)
+    return lambda: count_bytes(LZ77VarintRecordToBytesConverter().encode(make_lz77_encoder(parse).encode(chunks)))
+
+
+def lz77_decoder_stage(data, work_folder):
+    encoded = split_to_chunks(b''.join(LZ77VarintRecordToBytesConverter().encode(
+        make_lz77_encoder().encode(split_to_chunks(data)))))
+    return lambda: count_bytes(LZ77DecoderCore(Engine.lz77_window_width).decode(
+        LZ77VarintRecordToBytesConverter().decode(encoded)))
+
+
+def huffman_encoder_stage(data, work_folder):
+    """blocks with code lengths, without packing; output size is estimated by block entropy"""
+    chunks = split_to_chunks(data)
+
+    def run():
+        blocks = make_huffman_encoder().encode(chunks)
+        return sum(((block.get_encoded_bit_count() or 0) + 7) // 8 for block in blocks)
+    return run
+
+
+def huffman_converter_stage(data, work_folder):
+    blocks = list(make_huffman_encoder().encode(split_to_chunks(data)))
+    return lambda: count_bytes(CanonicalHuffmanBlockToBytesConverter().encode(blocks))
+
+
+def huffman_block_reader_stage(data, work_folder):
+    """parsing of blocks, without decoding; output size is packed data size"""
+    encoded = split_to_chunks(b''.join(CanonicalHuffmanBlockToBytesConverter().encode(
+        make_huffman_encoder().encode(split_to_chunks(data)))))
+
+    def run():
+        blocks = BytesToCanonicalHuffmanBlockConverter().decode(encoded)
+        return sum(len(block.data) if isinstance(block, StoredBlock) else len(block.packed_data)
+                   for block in blocks)
+    return run
+
+
+def huffman_decoder_stage(data, work_folder):
+    engine = Engine(work_folder)
+    encoded = split_to_chunks(b''.join(CanonicalHuffmanBlockToBytesConverter(
+        use_checksums=engine.flags_handler.use_checksums).encode(
+        make_huffman_encoder().encode(split_to_chunks(data)))))
+    return lambda: count_bytes(engine.make_decoded_data_stream(encoded))
+
+
+def engine_stage(data, work_folder, use_lz77=False, decompress=False):
+    """whole archive of one file"""
+    source = Path(work_folder, 'source.bin')
+    source.write_bytes(data)
+    archive = Path(work_folder, 'source' + Engine.compressed_file_extension)
+    output_folder = Path(work_folder, 'output')
+    output_folder.mkdir(exist_ok=True)
+    limit_megabytes = len(data) // (1024 * 1024) + 1
+    compressing_engine = Engine(source, work_folder, use_lz77=use_lz77, writing_limit_megabytes=limit_megabytes)
+    if not decompress:
+        def run():
+            compressing_engine.compress()
+            return archive.stat().st_size
+        return run
+    compressing_engine.compress()
+
+    def run():
+        Engine(archive, output_folder, writing_limit_megabytes=limit_megabytes).decompress()
+        return Path(output_folder, 'source', source.name).stat().st_size
+    return run
+
+
+def zlib_stage(data, work_folder):
+    return lambda: len(zlib.compress(data, 6))
+
+
+def lzma_stage(data, work_folder):
+    return lambda: len(lzma.compress(data, preset=1))
+
+
+STAGES = {
+    'read_file_stream': read_file_stage,
+    'write_to_file_limited': write_file_stage,
+    'cypher_legacy': legacy_cypher_stage,
+    'cypher_keystream': keystream_cypher_stage,
+    'lz77_encode': lz77_encoder_stage,
+    'lz77_encode_lazy': lambda data, work_folder: lz77_encoder_stage(data, work_folder, parse='lazy'),
+    'lz77_encode_lazy2': lambda data, work_folder: lz77_encoder_stage(data, work_folder, parse='lazy2'),
+    'lz77_encode_optimal': lambda data, work_folder: lz77_encoder_stage(data, work_folder, parse='optimal'),
+    'lz77_decode': lz77_decoder_stage,
+    'huffman_encoder_core': huffman_encoder_stage,
+    'huffman_to_bytes': huffman_converter_stage,
+    'bytes_to_huffman': huffman_block_reader_stage,
+    'huffman_decode': huffman_decoder_stage,
+    'engine_compress': engine_stage,
+    'engine_decompress': lambda data, work_folder: engine_stage(data, work_folder, decompress=True),
+    'engine_compress_lz77': lambda data, work_folder: engine_stage(data, work_folder, use_lz77=True),
+    'engine_decompress_lz77': lambda data, work_folder: engine_stage(data, work_folder, use_lz77=True,
+                                                                     decompress=True),
+    'zlib_6': zlib_stage,
+    'lzma_1': lzma_stage,
+}
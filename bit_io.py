@@ -0,0 +1,150 @@
+class BitWriter:
+    """packs bits from the lowest bit of each byte
+    bits are kept in an integer accumulator, full bytes go to bytearray"""
+    flush_threshold = 64
+
+    def __init__(self):
+        self.output = bytearray()
+        self.accumulator = 0
+        self.bit_count = 0  # bits in accumulator
+        pass
+
+    def write_bits(self, value: int, bit_count: int):
+        """lowest bit of value goes first; value must fit in bit_count bits"""
+        self.accumulator |= value << self.bit_count
+        self.bit_count += bit_count
+        if self.bit_count >= self.flush_threshold:
+            self.flush_full_bytes()
+        pass
+
+    def write_prefix_codes(self, data, codes: list, lengths: list):
+        """writes codes[item] of lengths[item] bits for every item of data;
+        same as write_bits in a loop, but inlined"""
+        output = self.output
+        accumulator = self.accumulator
+        bit_count = self.bit_count
+        for item in data:
+            accumulator |= codes[item] << bit_count
+            bit_count += lengths[item]
+            if bit_count >= 512:
+                output += (accumulator & ((1 << 512) - 1)).to_bytes(64, 'little')
+                accumulator >>= 512
+                bit_count -= 512
+        self.accumulator = accumulator
+        self.bit_count = bit_count
+        self.flush_full_bytes()
+        pass
+
+    def flush_full_bytes(self):
+        byte_count = self.bit_count >> 3
+        if byte_count == 0:
+            return
+        bit_count = byte_count << 3
+        self.output += (self.accumulator & ((1 << bit_count) - 1)).to_bytes(byte_count, 'little')
+        self.accumulator >>= bit_count
+        self.bit_count -= bit_count
+        pass
+
+    def align_to_byte(self):
+        """pads with zero bits; returns amount of filler bits"""
+        filler_bits_count = -self.bit_count & 7
+        self.bit_count += filler_bits_count
+        self.flush_full_bytes()
+        return filler_bits_count
+
+    def get_bytes(self):
+        """aligns to byte and returns everything written"""
+        self.align_to_byte()
+        return bytes(self.output)
+    pass
+
+
+class BitReader:
+    """reads bits packed from the lowest bit of each byte
+    data may be bytes, bytearray or memoryview; it is not copied"""
+    refill_bytes = 8
+
+    def __init__(self, data):
+        self.data = data
+        self.byte_position = 0  # next byte of data to go to accumulator
+        self.accumulator = 0
+        self.bit_count = 0  # bits in accumulator
+        pass
+
+    def refill(self):
+        part = self.data[self.byte_position:self.byte_position + self.refill_bytes]
+        self.accumulator |= int.from_bytes(part, 'little') << self.bit_count
+        self.bit_count += len(part) << 3
+        self.byte_position += len(part)
+        pass
+
+    def peek_bits(self, bit_count: int):
+        """bits after the end of data are read as zeros"""
+        while self.bit_count < bit_count and self.byte_position < len(self.data):
+            self.refill()
+        return self.accumulator & ((1 << bit_count) - 1)
+
+    def skip_bits(self, bit_count: int):
+        while self.bit_count < bit_count:
+            if self.byte_position >= len(self.data):
+                raise EOFError('no more bits')
+            self.refill()
+        self.accumulator >>= bit_count
+        self.bit_count -= bit_count
+        pass
+
+    def read_bits(self, bit_count: int):
+        value = self.peek_bits(bit_count)
+        self.skip_bits(bit_count)
+        return value
+
+    def align_to_byte(self):
+        self.skip_bits(self.bit_count & 7)
+        pass
+
+    def read_prefix_codes(self, table: list, lookup_bits: int, max_count: int, bit_limit: int):
+        """decodes prefix codes with lookup table of 2**lookup_bits entries:
+        (item, code length) for codes up to lookup_bits,
+        ((secondary table, its mask), any length > lookup_bits) for longer
+        codes, whose next bits index secondary table of (item, code length),
+        (any, 0) for bits that are not a start of a code
+        stops after max_count items or bit_limit bits; returns bytearray"""
+        data = self.data
+        byte_position = self.byte_position
+        accumulator = self.accumulator
+        accumulator_bits = self.bit_count
+        lookup_mask = (1 << lookup_bits) - 1
+        real_bits = self.bits_left()
+        bit_position = 0
+        output = bytearray()
+        for _ in range(max_count):
+            if bit_position >= bit_limit:
+                break
+            if accumulator_bits < 64:
+                # bytes after the end read as zeros, they are never used
+                accumulator |= int.from_bytes(
+                    data[byte_position:byte_position + 8], 'little') << accumulator_bits
+                byte_position += 8
+                accumulator_bits += 64
+            item, length = table[accumulator & lookup_mask]
+            if length > lookup_bits:
+                sub_table, sub_mask = item
+                item, length = sub_table[(accumulator >> lookup_bits) & sub_mask]
+            if length == 0:
+                raise ValueError(f'code not found at bit {bit_position}')
+            output.append(item)
+            accumulator >>= length
+            accumulator_bits -= length
+            bit_position += length
+        if bit_position > min(bit_limit, real_bits):
+            raise EOFError('data ended in the middle of code')
+        # give back zeros read after the end of data
+        overshoot_bytes = max(byte_position - len(data), 0)
+        self.byte_position = byte_position - overshoot_bytes
+        self.bit_count = accumulator_bits - (overshoot_bytes << 3)
+        self.accumulator = accumulator & ((1 << self.bit_count) - 1)
+        return output
+
+    def bits_left(self):
+        return self.bit_count + ((len(self.data) - self.byte_position) << 3)
+    pass
@@ -1,37 +1,40 @@
-from core_algorithms.LZ77_core import LZ77Record
-from byte_bit_buffer import ByteBitBuffer
-import struct
+from core_algorithms.LZ77_core import LZ77Record, LZ77EncoderCore
+from chunk_stream import DEFAULT_CHUNK_SIZE
+from itertools import chain
 
 
 class LZ77RecordToBytesConverter:
     """window width < 256
-    item == byte
+    item == int 0..255
     length < 256"""
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        pass
+
     def encode(self, record_stream):
-        buffer = ByteBitBuffer()
+        """yields bytes chunks of at least chunk_size (except the last one)"""
+        output = bytearray()
         for r in record_stream:
             r: LZ77Record = r
-            buffer.append_bytes_str(struct.pack('<B', r.lookback_index))
+            output.append(r.lookback_index)
             if r.lookback_index != 0:
-                buffer.append_bytes_str(struct.pack('<B', r.length))
+                output.append(r.length)
             else:
-                buffer.append_byte(r.item)
-            while buffer.has_bytes():
-                yield buffer.pop_byte()
+                output.append(r.item)
+            if len(output) >= self.chunk_size:
+                yield bytes(output)
+                output.clear()
+        if len(output) > 0:
+            yield bytes(output)
         pass
 
-    def decode(self, byte_stream):
-        buffer = ByteBitBuffer()
-        while True:
+    def decode(self, chunk_stream):
+        """takes stream of bytes chunks"""
+        byte_stream = chain.from_iterable(chunk_stream)
+        for lookback_index in byte_stream:
             try:
-                buffer.append_byte(next(byte_stream))
-                lookback_index = \
-                struct.unpack('<B', b''.join(buffer.pop_n_bytes(1)))[0]
                 if lookback_index != 0:
-                    buffer.append_byte(next(byte_stream))
-                    length = \
-                    struct.unpack('<B', b''.join(buffer.pop_n_bytes(1)))[
-                        0]
+                    length = next(byte_stream)
                     yield LZ77Record(lookback_index, length)
                 else:
                     item = next(byte_stream)
@@ -40,3 +43,113 @@ class LZ77RecordToBytesConverter:
                 break
         pass
     pass
+
+
+class LZ77VarintRecordToBytesConverter:
+    """any window width and length
+    literals between matches are kept together
+    FORMAT
+    -Sequences(+)
+    --repeated:
+    ---literals_count varint
+    ---literals ?B
+    ---lookback_index varint (0 == sequence has no match)
+    ---length varint (length - min_match_length; only if lookback_index != 0)
+    varint: 7 bits per byte, lowest first; high bit == more bytes follow
+    """
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, min_match_length=LZ77EncoderCore.min_match_length):
+        self.chunk_size = chunk_size
+        self.min_match_length = min_match_length
+        pass
+
+    def encode(self, record_stream):
+        """yields bytes chunks of at least chunk_size (except the last one)"""
+        output = bytearray()
+        literals = bytearray()
+        chunk_size = self.chunk_size
+        min_match_length = self.min_match_length
+        for r in record_stream:
+            r: LZ77Record = r
+            if r.lookback_index == 0:
+                literals.append(r.item)
+                if len(literals) < chunk_size:
+                    continue
+                # long run of literals goes out without waiting for a match
+                self.write_sequence(output, literals, 0)
+            else:
+                self.write_sequence(output, literals, r.lookback_index, r.length - min_match_length)
+            literals.clear()
+            if len(output) >= chunk_size:
+                yield bytes(output)
+                output.clear()
+        if len(literals) > 0:
+            self.write_sequence(output, literals, 0)
+        if len(output) > 0:
+            yield bytes(output)
+        pass
+
+    def write_sequence(self, output: bytearray, literals, lookback_index, length=0):
+        write_varint(output, len(literals))
+        output += literals
+        write_varint(output, lookback_index)
+        if lookback_index != 0:
+            write_varint(output, length)
+        pass
+
+    def decode(self, chunk_stream):
+        """takes stream of bytes chunks
+        yields literals as one bytes object per sequence and LZ77Record per match"""
+        data = bytearray()
+        position = 0
+        for chunk in chunk_stream:
+            # only unfinished sequence is kept
+            del data[:position]
+            data += chunk
+            position = yield from self.decode_sequences(data)
+        if position < len(data):
+            raise ValueError('LZ77 data ended in the middle of sequence')
+        pass
+
+    def decode_sequences(self, data: bytearray):
+        """generator; decodes whole sequences of data
+        returns position of the first unfinished one"""
+        position = 0
+        min_match_length = self.min_match_length
+        while True:
+            try:
+                literals_count, index = read_varint(data, position)
+                literals_end = index + literals_count
+                lookback_index, index = read_varint(data, literals_end)
+                length = 0
+                if lookback_index != 0:
+                    length, index = read_varint(data, index)
+            except IndexError:
+                return position
+            if literals_count > 0:
+                yield bytes(data[literals_end - literals_count:literals_end])
+            if lookback_index != 0:
+                yield LZ77Record(lookback_index, length + min_match_length)
+            position = index
+        pass
+    pass
+
+
+def write_varint(output: bytearray, value: int):
+    while value >= 0x80:
+        output.append(value & 0x7F | 0x80)
+        value >>= 7
+    output.append(value)
+    pass
+
+
+def read_varint(data, position):
+    """returns value and position after it; raises IndexError if data ends first"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
@@ -0,0 +1,200 @@
+from bit_io import BitWriter, BitReader
+from chunk_stream import ChunkReader
+from core_algorithms.huffman_core import HuffmanDataBlock, PackedHuffmanBlock, StoredBlock, get_canonical_code_map
+import struct
+import zlib
+
+
+HUFFMAN_BLOCK_TYPE = 0
+STORED_BLOCK_TYPE = 1
+
+# symbols of run length coded code lengths (as in deflate)
+REPEAT_PREVIOUS = 16  # 3..6 times, 2 extra bits
+REPEAT_ZERO_SHORT = 17  # 3..10 times, 3 extra bits
+REPEAT_ZERO_LONG = 18  # 11..138 times, 7 extra bits
+LENGTH_SYMBOL_BITS = 5
+
+
+class CanonicalHuffmanBlockToBytesConverter:
+    """converts HuffmanDataBlock sequence to sequence of bytes chunks
+    (one chunk per block)
+    codes are canonical, so only code lengths of items 0..255 are stored
+    bits are packed from the lowest bit of each byte
+    block that would get bigger after coding is stored as it is
+    FORMAT of a stored block
+    -block_type 1B (1 == stored)
+    -items_count 4B
+    -items ?B
+    -checksum 4B (crc32 of items; only with use_checksums)
+    FORMAT of a coded block
+    -block_type 1B (0 == huffman coded)
+    -items_count 4B
+    -Code_lengths(+)
+    --code_lengths_length_bytes 2B
+    --Run_length_coded_lengths(+)
+    ---repeated:
+    ----symbol 5bits (0..15 == code length,
+    -----16 == repeat previous length 3..6 times,
+    -----17 == repeat zero 3..10 times,
+    -----18 == repeat zero 11..138 times)
+    ----repeat_count_extra_bits [2/3/7]bits (for 16/17/18 only)
+    --zero_filler_bits [?<8]bits
+    -Data(+)
+    --data_length_bytes 4B
+    --Encoded_data(+)
+    ---repeated
+    ----code ?bits (first bit of code first)
+    --zero_filler_bits [?<8]bits
+    -checksum 4B (crc32 of items; only with use_checksums)
+    """
+    def __init__(self, int_format='>', use_checksums=False):
+        """int format defaults to big-endian"""
+        self.int_format = int_format
+        self.use_checksums = use_checksums
+        pass
+
+    def encode(self, sequence):
+        for block in sequence:
+            yield self.encode_block(block)
+        pass
+
+    def encode_block(self, block: HuffmanDataBlock):
+        lengths_bytes = self.get_code_lengths_bytes(block.code_lengths)
+        bit_count = block.get_encoded_bit_count()
+        # stored block has no lengths and data length fields
+        coded_overhead = 2 + len(lengths_bytes) + 4
+        if bit_count is not None and coded_overhead + (bit_count + 7) // 8 >= len(block.data):
+            return self.encode_stored_block(block.data)
+        data_bytes = self.get_data_bytes(block)
+        if coded_overhead + len(data_bytes) >= len(block.data):
+            return self.encode_stored_block(block.data)
+        return b''.join([struct.pack('<B', HUFFMAN_BLOCK_TYPE),
+                         struct.pack(f'{self.int_format}I', len(block.data)),
+                         struct.pack(f'{self.int_format}H', len(lengths_bytes)),
+                         lengths_bytes,
+                         struct.pack(f'{self.int_format}I', len(data_bytes)),
+                         data_bytes,
+                         self.get_checksum_bytes(block.data)])
+
+    def encode_stored_block(self, data: bytes):
+        return b''.join([struct.pack('<B', STORED_BLOCK_TYPE),
+                         struct.pack(f'{self.int_format}I', len(data)),
+                         data,
+                         self.get_checksum_bytes(data)])
+
+    def get_checksum_bytes(self, data: bytes):
+        if not self.use_checksums:
+            return b''
+        return struct.pack(f'{self.int_format}I', zlib.crc32(data))
+
+    def get_code_lengths_bytes(self, code_lengths: dict):
+        writer = BitWriter()
+        for symbol, repeat_count in run_length_encode(
+                [code_lengths.get(item, 0) for item in range(256)]):
+            writer.write_bits(symbol, LENGTH_SYMBOL_BITS)
+            if symbol == REPEAT_PREVIOUS:
+                writer.write_bits(repeat_count - 3, 2)
+            elif symbol == REPEAT_ZERO_SHORT:
+                writer.write_bits(repeat_count - 3, 3)
+            elif symbol == REPEAT_ZERO_LONG:
+                writer.write_bits(repeat_count - 11, 7)
+        return writer.get_bytes()
+
+    def get_data_bytes(self, block: HuffmanDataBlock):
+        # tables indexed by item
+        codes = [0] * 256
+        lengths = [0] * 256
+        for item, (code, length) in get_canonical_code_map(block.code_lengths).items():
+            codes[item] = code
+            lengths[item] = length
+        writer = BitWriter()
+        writer.write_prefix_codes(block.data, codes, lengths)
+        return writer.get_bytes()
+    pass
+
+
+class BytesToCanonicalHuffmanBlockConverter:
+    """converts sequence of bytes chunks to sequence of PackedHuffmanBlock
+    and StoredBlock
+    format is described in CanonicalHuffmanBlockToBytesConverter"""
+    def __init__(self, int_format='>', use_checksums=False):
+        """int format defaults to big-endian"""
+        self.int_format = int_format
+        self.use_checksums = use_checksums
+        pass
+
+    def decode(self, sequence):
+        """takes stream of bytes chunks"""
+        reader = ChunkReader(sequence)
+        while reader.has_bytes():
+            yield self.decode_block(reader)
+        pass
+
+    def decode_block(self, reader: ChunkReader):
+        block_type = reader.read_int('<B')
+        if block_type not in (HUFFMAN_BLOCK_TYPE, STORED_BLOCK_TYPE):
+            raise ValueError(f'unknown block type {block_type}')
+        items_count = reader.read_int(f'{self.int_format}I')
+        if block_type == STORED_BLOCK_TYPE:
+            data = reader.read(items_count)
+            return StoredBlock(data, self.read_checksum(reader))
+        lengths_length = reader.read_int(f'{self.int_format}H')
+        code_lengths = self.read_code_lengths(bytes(reader.read(lengths_length)))
+        data_length = reader.read_int(f'{self.int_format}I')
+        packed_data = reader.read(data_length)
+        code_map = get_canonical_code_map(code_lengths)
+        return PackedHuffmanBlock(code_map, packed_data, 8 * data_length, items_count,
+                                  self.read_checksum(reader))
+
+    def read_checksum(self, reader: ChunkReader):
+        if not self.use_checksums:
+            return None
+        return reader.read_int(f'{self.int_format}I')
+
+    def read_code_lengths(self, lengths_bytes: bytes):
+        """returns item -> code length for items with code"""
+        reader = BitReader(lengths_bytes)
+        lengths = []
+        while len(lengths) < 256:
+            symbol = reader.read_bits(LENGTH_SYMBOL_BITS)
+            if symbol < REPEAT_PREVIOUS:
+                lengths.append(symbol)
+            elif symbol == REPEAT_PREVIOUS:
+                if len(lengths) == 0:
+                    raise ValueError('nothing to repeat in code lengths')
+                lengths += [lengths[-1]] * (reader.read_bits(2) + 3)
+            elif symbol == REPEAT_ZERO_SHORT:
+                lengths += [0] * (reader.read_bits(3) + 3)
+            elif symbol == REPEAT_ZERO_LONG:
+                lengths += [0] * (reader.read_bits(7) + 11)
+            else:
+                raise ValueError(f'unknown code length symbol {symbol}')
+        if len(lengths) != 256:
+            raise ValueError('code lengths overflow 256 items')
+        return {item: length for item, length in enumerate(lengths) if length != 0}
+    pass
+
+
+def run_length_encode(lengths: list):
+    """yields (symbol, repeat_count) pairs; repeat_count is 1 for plain lengths"""
+    i = 0
+    while i < len(lengths):
+        length = lengths[i]
+        run = 1
+        while i + run < len(lengths) and lengths[i + run] == length:
+            run += 1
+        if length == 0 and run >= 3:
+            run = min(run, 138)
+            yield (REPEAT_ZERO_LONG if run >= 11 else REPEAT_ZERO_SHORT), run
+        else:
+            yield length, 1
+            run_left = run - 1
+            run = 1
+            while run_left >= 3:
+                repeat_count = min(run_left, 6)
+                yield REPEAT_PREVIOUS, repeat_count
+                run_left -= repeat_count
+                run += repeat_count
+        i += run
+    pass
+
@@ -0,0 +1,224 @@
+from fnmatch import fnmatchcase
+import os
+import struct
+
+
+DIRECTORY_MAGIC = b'DFDR'
+DIRECTORY_VERSION = 2
+RECORD_FORMATS = {1: '>IHQQQB', 2: '>IHQQQBI'}  # version -> record format
+
+IS_DIR_FLAG = 1
+IS_STORED_FLAG = 2  # file data is not compressed
+HAS_CHECKSUM_FLAG = 4
+
+
+class MembersNotFoundError(Exception):
+    pass
+
+
+class DirectoryEntry:
+    """file or directory inside archive
+    path is relative to archive root, parts are separated by '/'
+    checksum is crc32 of file content, None if unknown"""
+    def __init__(self, path: str, start_position_bytes=0, length_bytes=0,
+                 initial_size=0, flags=0, checksum=None):
+        self.path = path
+        self.start_position_bytes = start_position_bytes
+        self.length_bytes = length_bytes
+        self.initial_size = initial_size
+        self.flags = flags
+        self.checksum = checksum
+        pass
+
+    @property
+    def is_dir(self):
+        return self.flags & IS_DIR_FLAG != 0
+
+    @property
+    def is_stored(self):
+        return self.flags & IS_STORED_FLAG != 0
+
+    @property
+    def name(self):
+        return self.path.rsplit('/', 1)[-1]
+    pass
+
+
+class CentralDirectory:
+    """binary directory of archive; records are parsed only when asked for
+    FORMAT
+    -magic 4B == DFDR
+    -version 1B
+    -entries_count 4B
+    -root_name_length 2B
+    -root_name ?B (utf-8)
+    -Records(+) sorted by path parts
+    --repeated entries_count times:
+    ---path_offset 4B (in path table)
+    ---path_length 2B
+    ---start_position 8B
+    ---length 8B
+    ---initial_size 8B
+    ---flags 1B (bit 0 == directory, bit 1 == stored without compression, bit 2 == has checksum)
+    ---checksum 4B (crc32 of file content; since version 2)
+    -Path_table(+)
+    --paths ?B (utf-8, parts separated by '/')
+    """
+    header_format = '>4sBIH'
+    record_format = RECORD_FORMATS[DIRECTORY_VERSION]
+
+    def __init__(self, directory_bytes, allow_empty_root_name=False):
+        """allow_empty_root_name: old archives of a file without suffix have empty root name,
+        their files go right into destination folder"""
+        self.data = memoryview(directory_bytes)
+        magic, version, self.entries_count, root_name_length = \
+            struct.unpack_from(self.header_format, self.data)
+        if magic != DIRECTORY_MAGIC:
+            raise ValueError('not a binary directory')
+        if version not in RECORD_FORMATS:
+            raise ValueError(f'unsupported directory version {version}')
+        self.record_format = RECORD_FORMATS[version]
+        header_size = struct.calcsize(self.header_format)
+        self.root_name = decode_path(self.data[header_size:header_size + root_name_length])
+        if self.root_name != '' or not allow_empty_root_name:
+            check_path(self.root_name, is_root=True)
+        self.records_start = header_size + root_name_length
+        self.record_size = struct.calcsize(self.record_format)
+        self.path_table_start = self.records_start + self.entries_count * self.record_size
+        pass
+
+    def __len__(self):
+        return self.entries_count
+
+    def __iter__(self):
+        for i in range(self.entries_count):
+            yield self.get_entry(i)
+        pass
+
+    def get_entry(self, index):
+        path_offset, path_length, start, length, initial_size, flags, *checksum = \
+            struct.unpack_from(self.record_format, self.data,
+                               self.records_start + index * self.record_size)
+        checksum = checksum[0] if flags & HAS_CHECKSUM_FLAG else None
+        path = decode_path(self.get_path_bytes(index))
+        check_path(path)
+        return DirectoryEntry(path, start, length, initial_size, flags, checksum)
+
+    def get_path_bytes(self, index):
+        path_offset, path_length = struct.unpack_from(
+            '>IH', self.data, self.records_start + index * self.record_size)
+        start = self.path_table_start + path_offset
+        return self.data[start:start + path_length]
+
+    def find(self, path: str):
+        """binary search of entry by path; returns None if there is none"""
+        index = self.find_index(path)
+        if index < self.entries_count and \
+                get_sort_key(self.get_path_bytes(index)) == get_sort_key(encode_path(path)):
+            return self.get_entry(index)
+        return None
+
+    def find_index(self, path: str):
+        """index of entry with path, or where it would be"""
+        key = get_sort_key(encode_path(path))
+        low, high = 0, self.entries_count
+        while low < high:
+            middle = (low + high) // 2
+            if get_sort_key(self.get_path_bytes(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find_matching_files(self, patterns):
+        """file entries whose path matches one of glob patterns, in order of directory;
+        pattern without wildcards is a path of file or of directory, directory matches
+        every file under it; such patterns are binary searched
+        raises MembersNotFoundError if some pattern matches no file"""
+        glob_patterns = [p for p in patterns if has_wildcards(p)]
+        matches = {p: [] for p in patterns}  # pattern -> indexes of entries
+        if len(glob_patterns) > 0:
+            for i in range(self.entries_count):
+                path = decode_path(self.get_path_bytes(i))
+                for pattern in glob_patterns:
+                    if fnmatchcase(path, pattern):
+                        matches[pattern].append(i)
+        for pattern in patterns:
+            if not has_wildcards(pattern):
+                matches[pattern] = self.find_indexes_under(pattern.rstrip('/'))
+        entries = {i: self.get_entry(i) for indexes in matches.values() for i in indexes}
+        unmatched = [p for p in matches if all(entries[i].is_dir for i in matches[p])]
+        if len(unmatched) > 0:
+            raise MembersNotFoundError(f'no files in archive match {", ".join(map(repr, unmatched))}')
+        return [entries[i] for i in sorted(entries) if not entries[i].is_dir]
+
+    def find_indexes_under(self, path: str):
+        """index of entry with path and, if it is directory, indexes of everything under it"""
+        index = self.find_index(path)
+        key = get_sort_key(encode_path(path))
+        if index >= self.entries_count or get_sort_key(self.get_path_bytes(index)) != key:
+            return range(0)
+        # content of directory goes right after it
+        end = index + 1
+        while end < self.entries_count and get_sort_key(self.get_path_bytes(end)).startswith(key + b'\x00'):
+            end += 1
+        return range(index, end)
+    pass
+
+
+def encode_central_directory(root_name: str, entries: list):
+    """entries: DirectoryEntry list in any order"""
+    encoded_entries = sorted(((encode_path(e.path), e) for e in entries),
+                             key=lambda pair: get_sort_key(pair[0]))
+    root_name_bytes = encode_path(root_name)
+    records = []
+    path_table = []
+    path_offset = 0
+    for path_bytes, e in encoded_entries:
+        flags = e.flags & ~HAS_CHECKSUM_FLAG
+        if e.checksum is not None:
+            flags |= HAS_CHECKSUM_FLAG
+        records.append(struct.pack(CentralDirectory.record_format, path_offset, len(path_bytes),
+                                   e.start_position_bytes, e.length_bytes, e.initial_size, flags,
+                                   e.checksum or 0))
+        path_table.append(path_bytes)
+        path_offset += len(path_bytes)
+    header = struct.pack(CentralDirectory.header_format, DIRECTORY_MAGIC, DIRECTORY_VERSION,
+                         len(records), len(root_name_bytes))
+    return b''.join([header, root_name_bytes] + records + path_table)
+
+
+def is_central_directory(directory_bytes):
+    return bytes(directory_bytes[:len(DIRECTORY_MAGIC)]) == DIRECTORY_MAGIC
+
+
+def get_sort_key(path_bytes):
+    """directory goes right before its content"""
+    return bytes(path_bytes).replace(b'/', b'\x00')
+
+
+def encode_path(path: str):
+    return path.encode('utf-8', 'surrogateescape')
+
+
+def decode_path(path_bytes):
+    return bytes(path_bytes).decode('utf-8', 'surrogateescape')
+
+
+def check_path(path: str, is_root=False):
+    """archive may be crafted: its paths must stay inside destination folder
+    root name is one part, other paths are relative parts separated by '/'"""
+    parts = [path] if is_root else path.split('/')
+    is_unsafe = any(part in ('', '.', '..') or '/' in part for part in parts)
+    if os.name == 'nt':
+        # on Windows \ separates folders too and C: is a drive;
+        # elsewhere they are usual characters of names
+        has_drive = len(parts[0]) >= 2 and parts[0][1] == ':' and parts[0][0].isalpha()
+        is_unsafe = is_unsafe or has_drive or any('\\' in part for part in parts)
+    if is_unsafe:
+        raise ValueError(f'unsafe path in archive directory: {path!r}')
+    pass
+
+
+def has_wildcards(pattern: str):
+    return any(c in pattern for c in '*?[')
@@ -1,29 +1,105 @@
+import hashlib
 import random
-import struct
 
 
 class CypherStream:
+    """legacy cypher: adds randint(0, 255) of random.Random to every byte
+    kept to decode old archives; KeystreamCypherStream is much faster"""
     def __init__(self, key):
+        self.key = key
         self.rand = random.Random()
         self.rand.seed(key, version=2)
+        self.position = 0  # how many bytes of keystream are used
         pass
 
-    def encode(self, byte_sequence):
+    def encode(self, chunk_sequence):
+        """takes and yields bytes chunks"""
         rand = self.get_rand()
-        for byte in byte_sequence:
-            byte_int = struct.unpack('<B', byte)[0]
-            byte_shifted = (byte_int + rand.randint(0, 255)) % 256
-            yield struct.pack('<B', byte_shifted)
+        for chunk in chunk_sequence:
+            self.position += len(chunk)
+            yield bytes([(byte + rand.randint(0, 255)) & 0xFF
+                         for byte in chunk])
         pass
 
-    def decode(self, byte_sequence):
+    def decode(self, chunk_sequence):
+        """takes and yields bytes chunks"""
         rand = self.get_rand()
-        for byte in byte_sequence:
-            byte_int = struct.unpack('<B', byte)[0]
-            byte_shifted = (256 + byte_int - rand.randint(0, 255)) % 256
-            yield struct.pack('<B', byte_shifted)
+        for chunk in chunk_sequence:
+            self.position += len(chunk)
+            yield bytes([(byte - rand.randint(0, 255)) & 0xFF
+                         for byte in chunk])
+        pass
+
+    def seek(self, position):
+        """moves to position in keystream; going back starts from the beginning"""
+        if position < self.position:
+            self.rand.seed(self.key, version=2)
+            self.position = 0
+        rand = self.get_rand()
+        for _ in range(position - self.position):
+            rand.randint(0, 255)
+        self.position = position
         pass
 
     def get_rand(self):
         return self.rand
     pass
+
+
+class KeystreamCypherStream:
+    """XORs chunks with keystream made in blocks: block i == shake_256(key + nonce + i)
+    so keystream is made in bulk and any position is reached at once;
+    encoding and decoding are the same
+    nonce must be new for every encoded stream (like random salt of archive),
+    otherwise streams encoded with the same key share keystream"""
+    block_size = 64 * 1024
+
+    def __init__(self, key: bytes, nonce=b''):
+        self.key = key
+        self.nonce = nonce
+        self.position = 0  # how many bytes of keystream are used
+        self.block_index = None
+        self.block = b''
+        pass
+
+    def encode(self, chunk_sequence):
+        """takes and yields bytes chunks"""
+        for chunk in chunk_sequence:
+            yield self.xor_chunk(chunk)
+        pass
+
+    def decode(self, chunk_sequence):
+        """takes and yields bytes chunks"""
+        return self.encode(chunk_sequence)
+
+    def xor_chunk(self, chunk):
+        """whole chunk is XORed as one big integer"""
+        keystream = self.get_keystream(self.position, len(chunk))
+        self.position += len(chunk)
+        return (int.from_bytes(chunk, 'little') ^ int.from_bytes(keystream, 'little')).to_bytes(
+            len(chunk), 'little')
+
+    def get_keystream(self, position, length):
+        parts = []
+        block_index, offset = divmod(position, self.block_size)
+        while length > 0:
+            part = self.get_block(block_index)[offset:offset + length]
+            parts.append(part)
+            length -= len(part)
+            block_index += 1
+            offset = 0
+        return b''.join(parts)
+
+    def get_block(self, block_index):
+        """last block is kept, chunks are usually smaller than block"""
+        if block_index != self.block_index:
+            self.block = hashlib.shake_256(self.key + self.nonce + block_index.to_bytes(8, 'big')).digest(
+                self.block_size)
+            self.block_index = block_index
+        return self.block
+
+    def seek(self, position):
+        """moves to position in keystream"""
+        self.position = position
+        pass
+    pass
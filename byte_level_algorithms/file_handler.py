@@ -1,47 +1,131 @@
-from byte_bit_buffer import ByteBitBuffer
+from chunk_stream import DEFAULT_CHUNK_SIZE
+import multiprocessing
+import mmap
+import os
+import stat
 
 
-def read_file_stream(file_path):
+def read_file_stream(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """yields bytes chunks of at most chunk_size
+    regular files are memory mapped, see read_file_segment_stream"""
+    return read_file_segment_stream(file_path, 0, None, chunk_size)
+
+
+def read_file_segment_stream(file_path, start_pos: int, length: int | None,
+                             chunk_size=DEFAULT_CHUNK_SIZE):
+    """yields bytes chunks of at most chunk_size; length None == up to the end
+    chunks of regular files are memoryview slices of the mapped file (no copies),
+    other files (pipes, devices) are read with buffered reads"""
     with open(file_path, 'rb') as f:
-        buffer = ByteBitBuffer()
-        step = 10000
-        while True:
-            if not buffer.has_bytes():
-                buffer.append_bytes_str(f.read(step))
-            if not buffer.has_bytes():
-                break
-            yield buffer.pop_byte()
+        mapped_file = map_file(f)
+        if mapped_file is None:
+            f.seek(start_pos)
+            while length is None or length > 0:
+                chunk = f.read(chunk_size if length is None else min(chunk_size, length))
+                if len(chunk) == 0:
+                    break
+                if length is not None:
+                    length -= len(chunk)
+                yield chunk
+            return
+    end_pos = len(mapped_file) if length is None else min(start_pos + length, len(mapped_file))
+    view = memoryview(mapped_file)
+    try:
+        for position in range(start_pos, end_pos, chunk_size):
+            yield view[position:min(position + chunk_size, end_pos)]
+    finally:
+        view.release()
+        try:
+            mapped_file.close()
+        except BufferError:
+            # some chunks are still used; mapping is closed when they are gone
+            pass
     pass
 
 
-def read_file_segment_stream(file_path, start_pos: int, length: int):
-    buffer = ByteBitBuffer()
-    step = 10000
-    with open(file_path, 'rb') as f:
-        f.seek(start_pos)
-        while True:
-            if not buffer.has_bytes():
-                read_count = min(step, length)
-                buffer.append_bytes_str(f.read(read_count))
-                length -= read_count
-            if not buffer.has_bytes():
-                break
-            yield buffer.pop_byte()
+def map_file(f):
+    """read only mapping of whole file or None if file can not be mapped"""
+    file_stat = os.fstat(f.fileno())
+    if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size == 0:
+        return None
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def read_binary_stream(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """yields bytes chunks of opened binary stream (like sys.stdin.buffer) up to its end"""
+    while True:
+        chunk = stream.read(chunk_size)
+        if len(chunk) == 0:
+            break
+        yield chunk
+    pass
+
+
+class WritingLimitError(Exception):
     pass
 
 
-def write_to_file_limited(file_path, sequence, limit_in_bytes, mode='wb'):
-    """returns limit left"""
+def write_to_file_limited(file_path, sequence, limit_in_bytes, mode='wb', strict=False):
+    """sequence of bytes chunks
+    returns limit left"""
     with open(file_path, mode) as f:
-        byte_buffer = ByteBitBuffer()
-        step = 10000
-        while limit_in_bytes > 0:
-            for i, byte in enumerate(sequence):
-                byte_buffer.append_byte(byte)
-                if i >= step:
-                    break
-            if not byte_buffer.has_bytes():
-                break
-            limit_in_bytes -= len(byte_buffer.byte_buffer)
-            f.write(b''.join(byte_buffer.pop_all_bytes()))
+        return write_to_stream_limited(f, sequence, limit_in_bytes, strict)
+
+
+def write_to_stream_limited(stream, sequence, limit_in_bytes, strict=False):
+    """writes to opened binary stream (like sys.stdout.buffer)
+    limit None == no limit
+    writing stops at the limit; with strict WritingLimitError is raised instead
+    returns limit left"""
+    for chunk in sequence:
+        if limit_in_bytes is None:
+            stream.write(chunk)
+            continue
+        if strict and len(chunk) > limit_in_bytes:
+            raise WritingLimitError(f'writing limit is reached, {limit_in_bytes} bytes were left')
+        if limit_in_bytes <= 0:
+            break
+        if len(chunk) > limit_in_bytes:
+            chunk = chunk[:limit_in_bytes]
+        stream.write(chunk)
+        limit_in_bytes -= len(chunk)
     return limit_in_bytes
+
+
+class SharedWritingLimit:
+    """writing limit shared by processes; taking from it is atomic
+    pass it to workers at their start (e.g. in pool initargs)"""
+    def __init__(self, limit_in_bytes):
+        self.left = multiprocessing.Value('q', limit_in_bytes)
+        pass
+
+    def take(self, n, strict=False):
+        """returns how many of n bytes can be written;
+        with strict it is n or 0, nothing is taken if n does not fit"""
+        with self.left.get_lock():
+            allowed = max(min(n, self.left.value), 0)
+            if strict and allowed < n:
+                allowed = 0
+            self.left.value -= allowed
+        return allowed
+
+    def get_left(self):
+        return self.left.value
+    pass
+
+
+def write_to_file_shared_limited(file_path, sequence, limit: SharedWritingLimit, mode='wb', strict=False):
+    """sequence of bytes chunks
+    writing stops at the limit; with strict WritingLimitError is raised instead"""
+    with open(file_path, mode) as f:
+        for chunk in sequence:
+            allowed = limit.take(len(chunk), strict)
+            if strict and allowed < len(chunk):
+                raise WritingLimitError(f'writing limit is reached, {limit.get_left()} bytes were left')
+            f.write(chunk[:allowed])
+            if allowed < len(chunk):
+                break
+    pass
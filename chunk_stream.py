@@ -0,0 +1,46 @@
+import struct
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class ChunkReader:
+    """reads exact amounts of bytes out of a stream of bytes chunks
+    chunks may be bytes, bytearray or memoryview"""
+    def __init__(self, chunk_stream):
+        self.chunk_stream = iter(chunk_stream)
+        self.chunk = b''
+        self.position = 0
+        pass
+
+    def has_bytes(self):
+        while self.position >= len(self.chunk):
+            try:
+                self.chunk = next(self.chunk_stream)
+            except StopIteration:
+                return False
+            self.position = 0
+        return True
+
+    def read(self, n):
+        """returns exactly n bytes; raises EOFError if stream ends earlier"""
+        if len(self.chunk) - self.position >= n:
+            result = self.chunk[self.position:self.position + n]
+            self.position += n
+            return result
+        parts = []
+        left = n
+        while left > 0:
+            if not self.has_bytes():
+                raise EOFError(f'stream ended; {left} of {n} bytes missing')
+            part = self.chunk[self.position:self.position + left]
+            self.position += len(part)
+            left -= len(part)
+            parts.append(part)
+        return b''.join(parts)
+
+    def read_int(self, int_format):
+        """reads one struct-formatted integer, e.g. '>I'"""
+        return struct.unpack(int_format, self.read(struct.calcsize(int_format)))[0]
+    pass
+
@@ -1,123 +1,326 @@
-from collections import deque
+from chunk_stream import DEFAULT_CHUNK_SIZE
+
+
+DEFAULT_MAX_CHAIN_LENGTH = 32
+# greedy takes the longest match; lazy and lazy2 first check whether a match
+# 1 or 2 items later is longer; optimal chooses records of a block by cost
+PARSE_STRATEGIES = ('greedy', 'lazy', 'lazy2', 'optimal')
+DEFAULT_PARSE = 'greedy'
 
 
 class LZ77DecoderCore:
-    def __init__(self, window_width):
+    """keeps window and not yet yielded output in one bytearray;
+    matches are copied by slices"""
+    def __init__(self, window_width, chunk_size=DEFAULT_CHUNK_SIZE):
         self.window_width = window_width
-        self.buffer = deque()
-        pass
-
-    def pump_to_buffer(self, item):
-        self.buffer.append(item)
-        if len(self.buffer) > self.window_width:
-            self.buffer.popleft()
+        self.chunk_size = chunk_size
         pass
 
     def decode(self, generator):
-        """generator itself"""
+        """generator itself
+        takes LZ77Record sequence, where runs of literals may also come as bytes objects
+        yields bytes chunks of at least chunk_size (except the last one)"""
+        buffer = bytearray()
+        yielded = 0  # items at the start of buffer that are only window
+        chunk_size = self.chunk_size
         for r in generator:
-            record: LZ77Record = r
-            if record.lookback_index == 0:
-                self.pump_to_buffer(record.item)
-                yield record.item
+            if not isinstance(r, LZ77Record):
+                buffer += r
+            elif r.lookback_index == 0:
+                buffer.append(r.item)
             else:
-                for _ in range(record.length):
-                    item = self.buffer[-record.lookback_index]
-                    self.pump_to_buffer(item)
-                    yield item
+                self.copy_match(buffer, r.lookback_index, r.length)
+            if len(buffer) - yielded >= chunk_size:
+                yield bytes(buffer[yielded:])
+                # deleting from the start of bytearray does not move the rest
+                del buffer[:max(len(buffer) - self.window_width, 0)]
+                yielded = len(buffer)
+        if len(buffer) > yielded:
+            yield bytes(buffer[yielded:])
+        pass
+
+    def copy_match(self, buffer: bytearray, lookback_index, length):
+        """appends length items starting lookback_index items back;
+        overlapping match repeats its part, so copied part doubles every step"""
+        start = len(buffer) - lookback_index
+        if start < 0:
+            raise ValueError('lookback index goes before the start of data')
+        while length > 0:
+            part = buffer[start:start + length]
+            buffer += part
+            length -= len(part)
         pass
 
 
 class LZ77EncoderCore:
-    def __init__(self, window_width, sequence_max_length):
+    """LZ77 over a contiguous window
+    matches are searched with hash chains of 3-item prefixes,
+    max_chain_length bounds candidates checked per position (speed vs ratio)
+    parse is one of PARSE_STRATEGIES; every one of them searches at most
+    lazy steps + 1 hash chains per item, so time per item stays bounded"""
+    min_match_length = 3
+    hash_mask = 0xFFFF
+    # lazy parse takes a match this long without looking further
+    lazy_good_length = 32
+    # optimal parse: items in a block, and how many of the longest lengths
+    # of a match are tried
+    optimal_block_length = 4096
+    optimal_length_choices = 8
+
+    def __init__(self, window_width, sequence_max_length,
+                 max_chain_length=DEFAULT_MAX_CHAIN_LENGTH, parse=DEFAULT_PARSE):
+        if sequence_max_length < self.min_match_length:
+            raise ValueError(f'sequence max length must be at least '
+                             f'{self.min_match_length}')
+        if parse not in PARSE_STRATEGIES:
+            raise ValueError(f'parse must be one of {PARSE_STRATEGIES}')
         self.window_width = window_width
         self.sequence_max_length = sequence_max_length
-        self.search_buffer = deque()
-        self.look_ahead_buffer = deque()
+        self.max_chain_length = max_chain_length
+        self.parse = parse
+        # ring of previous positions; must be longer than the window
+        self.chain_mask = (1 << window_width.bit_length()) - 1
+        self.reset()
         pass
 
-    def encode(self, generator):
-        """generator itself"""
-        self.fill_buffers_initial(generator)
-        while len(self.look_ahead_buffer) > 0:
-            best_ref_index, best_len = self.find_optimal_reference_index()
-            # print(best_len)
-            if best_ref_index == 0:
-                item = self.indexer(0)
-                yield LZ77Record(lookback_index=0, length=1, item=item)
-            else:
-                yield LZ77Record(lookback_index=-best_ref_index, length=best_len)
-            for _ in range(best_len):
-                self.try_move_item_to_search_buffer(generator)
+    def reset(self):
+        self.data = b''
+        self.data_start = 0  # absolute position of data[0]
+        self.head = [-1] * (self.hash_mask + 1)
+        self.chain = [-1] * (self.chain_mask + 1)
         pass
 
-    def find_optimal_reference_index(self):
-        """index where match is the longest or 0 if no match"""
-        best_len = 1
-        best_index = 0
-        for i in range(1, 1 + len(self.search_buffer)):
-            cur_index = -i
-            cur_len = self.get_common_length(cur_index)
-            if cur_len > best_len:
-                best_index = cur_index
-                best_len = cur_len
-        # remember: best_index <= 0
-        return best_index, best_len
-
-    def get_common_length(self, search_position):
-        """search_position = position in search buffer
-        from right to left starting at -1 and going to -buffer_len"""
-        length = 0
-        while self.can_be_indexed(length) and length < self.sequence_max_length:
-            search_item = self.indexer(search_position + length)
-            ahead_item = self.indexer(length)
-            if search_item == ahead_item:
-                length += 1
+    def encode(self, chunk_stream, history=b''):
+        """generator itself
+        takes stream of bytes chunks; items are ints 0..255
+        history: items before the stream, they fill window but are not encoded"""
+        self.reset()
+        self.data = bytes(history[-self.window_width:])
+        position = len(self.data)
+        self.insert_hashes(0, position)
+        for chunk in chunk_stream:
+            self.data += chunk
+            # leave full look ahead, so matches are not cut at chunk borders
+            end = self.data_start + len(self.data) - self.sequence_max_length
+            position = yield from self.encode_range(position, end)
+            self.drop_old_data(position)
+        end = self.data_start + len(self.data)
+        yield from self.encode_range(position, end)
+        pass
+
+    def encode_range(self, position, end):
+        """generator; encodes records starting before end
+        returns position after the last record"""
+        if self.parse == 'greedy':
+            return (yield from self.encode_range_greedy(position, end))
+        if self.parse == 'optimal':
+            return (yield from self.encode_range_optimal(position, end))
+        return (yield from self.encode_range_lazy(position, end, 1 if self.parse == 'lazy' else 2))
+
+    def encode_range_greedy(self, position, end):
+        """takes the longest match at every record start"""
+        data = self.data
+        data_start = self.data_start
+        data_length = len(data)
+        head = self.head
+        chain = self.chain
+        hash_mask = self.hash_mask
+        chain_mask = self.chain_mask
+        min_match_length = self.min_match_length
+        while position < end:
+            index = position - data_start
+            max_length = min(self.sequence_max_length, data_length - index)
+            if max_length < min_match_length:
+                yield LZ77Record(lookback_index=0, length=1, item=data[index])
+                position += 1
+                continue
+            h = ((data[index] << 8) ^ (data[index + 1] << 4)
+                 ^ data[index + 2]) & hash_mask
+            best_ref_index, best_len = self.find_longest_match(
+                position, head[h], max_length)
+            chain[position & chain_mask] = head[h]
+            head[h] = position
+            if best_ref_index == 0:
+                yield LZ77Record(lookback_index=0, length=1, item=data[index])
+                position += 1
             else:
-                break
-        return length
-
-    def can_be_indexed(self, index):
-        if index < 0:
-            return len(self.search_buffer) >= abs(index)
-        return len(self.look_ahead_buffer) > index
-
-    def indexer(self, index):
-        if not self.can_be_indexed(index):
-            raise IndexError('out of range')
-        if index < 0:
-            return self.search_buffer[index]
-        return self.look_ahead_buffer[index]
-
-    def try_move_item_to_search_buffer(self, generator):
-        if len(self.look_ahead_buffer) == 0:
-            return False
-        item = self.look_ahead_buffer.popleft()
-
-        self.search_buffer.append(item)
-        if len(self.search_buffer) > self.window_width:
-            self.search_buffer.popleft()
-
-        try:
-            item = next(generator)
-            self.look_ahead_buffer.append(item)
-        except StopIteration:
-            pass
-        return True
-
-    def fill_buffers_initial(self, generator):
-        self.search_buffer.clear()
-        self.look_ahead_buffer.clear()
-        look_ahead_buffer_len = self.window_width
-        for i, item in enumerate(generator):
-            self.look_ahead_buffer.append(item)
-            if i + 1 >= look_ahead_buffer_len:
-                break
+                yield LZ77Record(lookback_index=best_ref_index, length=best_len)
+                position += best_len
+                self.insert_hashes(position - best_len + 1, position)
+        return position
+
+    def encode_range_lazy(self, position, end, lazy_steps):
+        """match is put off by one literal (or two), if a match
+        starting right after it is longer"""
+        data = self.data
+        data_start = self.data_start
+        lazy_good_length = self.lazy_good_length
+        pending = None
+        while position < end:
+            if pending is None:
+                pending = self.find_and_insert(position)
+            lookback_index, length = pending
+            pending = None
+            if lookback_index == 0:
+                yield LZ77Record(lookback_index=0, length=1, item=data[position - data_start])
+                position += 1
+                continue
+            step = 1
+            if length < lazy_good_length:
+                while step <= lazy_steps and position + step < end:
+                    later = self.find_and_insert(position + step)
+                    # literals before later match cost about an item each
+                    if later[1] > length + step - 1:
+                        pending = later
+                        break
+                    step += 1
+            if pending is not None:
+                for index in range(position - data_start, position - data_start + step):
+                    yield LZ77Record(lookback_index=0, length=1, item=data[index])
+                position += step
+                continue
+            yield LZ77Record(lookback_index=lookback_index, length=length)
+            self.insert_hashes(position + step, position + length)
+            position += length
+        return position
+
+    def encode_range_optimal(self, position, end):
+        """blocks of optimal_block_length items: longest match of every position is found,
+        then records of the cheapest path through the block are taken"""
+        data = self.data
+        data_start = self.data_start
+        min_match_length = self.min_match_length
+        while position < end:
+            block_end = min(position + self.optimal_block_length, end)
+            matches = [self.find_and_insert(p) for p in range(position, block_end)]
+            block_length = block_end - position
+            # cost[i]: bits to encode items from position + i to block end
+            cost = [0] * (block_length + 1)
+            choice = [1] * block_length
+            literal_cost = self.get_record_cost(0, 1)
+            for i in range(block_length - 1, -1, -1):
+                best_cost = cost[i + 1] + literal_cost
+                best_length = 1
+                lookback_index, length = matches[i]
+                if lookback_index != 0:
+                    length = min(length, block_length - i)
+                    shortest = max(min_match_length, length - self.optimal_length_choices + 1)
+                    for candidate in range(length, shortest - 1, -1):
+                        candidate_cost = cost[i + candidate] + self.get_record_cost(lookback_index, candidate)
+                        if candidate_cost < best_cost:
+                            best_cost = candidate_cost
+                            best_length = candidate
+                cost[i] = best_cost
+                choice[i] = best_length
+            i = 0
+            while i < block_length:
+                if choice[i] == 1:
+                    yield LZ77Record(lookback_index=0, length=1, item=data[position + i - data_start])
+                else:
+                    yield LZ77Record(lookback_index=matches[i][0], length=choice[i])
+                i += choice[i]
+            position = block_end
+        return position
+
+    def get_record_cost(self, lookback_index, length):
+        """rough size of record in bits: a byte per item of literal,
+        for match a byte of literals count and varints of lookback index and length"""
+        if lookback_index == 0:
+            return 8
+        return 8 + 8 * get_varint_length(lookback_index) + 8 * get_varint_length(length - self.min_match_length)
+
+    def find_and_insert(self, position):
+        """(lookback index, length) of the longest match at position, or (0, 1);
+        position is added to hash chains"""
+        index = position - self.data_start
+        max_length = min(self.sequence_max_length, len(self.data) - index)
+        if max_length < self.min_match_length:
+            return 0, 1
+        h = self.get_hash(index)
+        match = self.find_longest_match(position, self.head[h], max_length)
+        self.chain[position & self.chain_mask] = self.head[h]
+        self.head[h] = position
+        return match
+
+    def find_longest_match(self, position, candidate, max_length):
+        """walks hash chain starting at candidate"""
+        data = self.data
+        data_start = self.data_start
+        index = position - data_start
+        chain = self.chain
+        chain_mask = self.chain_mask
+        best_len = self.min_match_length - 1
+        best_position = -1
+        limit = position - self.window_width
+        chain_left = self.max_chain_length
+        while candidate >= limit and candidate >= 0 and chain_left > 0:
+            candidate_index = candidate - data_start
+            # only item that can make this match longer than best is checked
+            if data[candidate_index + best_len] == data[index + best_len]:
+                cur_len = self.get_common_length(candidate_index, index, max_length)
+                if cur_len > best_len:
+                    best_len = cur_len
+                    best_position = candidate
+                    if cur_len >= max_length:
+                        break
+            candidate = chain[candidate & chain_mask]
+            chain_left -= 1
+        if best_position < 0:
+            return 0, 1
+        return position - best_position, best_len
+
+    def get_common_length(self, search_index, ahead_index, max_length):
+        """length of common prefix of data at both indexes (overlap allowed)"""
+        search = self.data[search_index:search_index + max_length]
+        ahead = self.data[ahead_index:ahead_index + max_length]
+        if search == ahead:
+            return max_length
+        # lowest set bit of xor marks the first differing item
+        difference = int.from_bytes(search, 'little') ^ int.from_bytes(ahead, 'little')
+        return ((difference & -difference).bit_length() - 1) >> 3
+
+    def get_hash(self, index):
+        data = self.data
+        return ((data[index] << 8) ^ (data[index + 1] << 4)
+                ^ data[index + 2]) & self.hash_mask
+
+    def insert_hashes(self, from_position, until_position):
+        """adds positions in [from_position, until_position) to hash chains
+        positions too close to the end of data are skipped"""
+        data = self.data
+        data_start = self.data_start
+        head = self.head
+        chain = self.chain
+        chain_mask = self.chain_mask
+        from_index = from_position - data_start
+        until_index = min(until_position - data_start,
+                          len(data) - self.min_match_length + 1)
+        hashes = [((a << 8) ^ (b << 4) ^ c) & self.hash_mask for a, b, c in
+                  zip(data[from_index:until_index],
+                      data[from_index + 1:until_index + 1],
+                      data[from_index + 2:until_index + 2])]
+        position = from_position
+        for h in hashes:
+            chain[position & chain_mask] = head[h]
+            head[h] = position
+            position += 1
         pass
 
+    def drop_old_data(self, position):
+        """keeps only window before position"""
+        drop_count = position - self.window_width - self.data_start
+        if drop_count > 0:
+            self.data = self.data[drop_count:]
+            self.data_start += drop_count
+        pass
     pass
 
 
+def get_varint_length(value):
+    """bytes taken by value written with 7 bits per byte"""
+    return max(1, (value.bit_length() + 6) // 7)
+
+
 class LZ77Record:
     def __init__(self, lookback_index: int, length: int, item=None):
         if lookback_index < 0:
@@ -143,7 +346,7 @@ def test():
 
     data = text * 10
 
-    result = list(LZ77EncoderCore(1000, 800).encode(iter(data)))
+    result = list(LZ77EncoderCore(1000, 800).encode([data.encode()]))
 
     translated = []
     for record in result:
@@ -153,8 +356,8 @@ def test():
         else:
             translated.append(record.length)
 
-    decoded_data = list(LZ77DecoderCore(1000).decode(iter(result)))
+    decoded_data = b''.join(LZ77DecoderCore(1000).decode(iter(result)))
 
-    print([letter for letter in data])
+    print(data)
     print(translated)
     print(decoded_data)
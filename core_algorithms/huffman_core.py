@@ -1,4 +1,8 @@
 import heapq
+import zlib
+import math
+from collections import Counter, deque
+from bit_io import BitReader
 
 
 class Node:
@@ -16,55 +20,57 @@ class Node:
 
 
 class HuffmanEncoderCore:
+    """emits blocks with code lengths only; codes are canonical
+    (see get_canonical_code_map)"""
+    max_code_length = 15
+
     def __init__(self, block_length):
         self.block_length = block_length
-        self.buffer = []
+        self.buffer = bytearray()
         pass
 
-    def encode(self, iterator):
-        """generator itself"""
-        while True:
-            self.pump_to_buffer(iterator)
-            if len(self.buffer) == 0:
-                break
-            yield self.encode_buffer()
+    def encode(self, chunk_iterator):
+        """generator itself
+        takes stream of bytes chunks; items of blocks are ints 0..255"""
+        self.buffer.clear()
+        for chunk in chunk_iterator:
+            self.buffer += chunk
+            while len(self.buffer) >= self.block_length:
+                yield self.encode_buffer(self.pop_block())
+        if len(self.buffer) > 0:
+            yield self.encode_buffer(self.pop_block())
         pass
 
-    def encode_buffer(self):
-        block_distribution = self.calculate_distribution_in_buffer()
-        tree_root = self.build_tree(block_distribution)
-        code_map = self.get_code_map(tree_root)
-        block_data = []
-        for item in self.buffer:
-            block_data.append(code_map[item])
-        item_to_code = []
-        for k, v in code_map.items():
-            item_to_code.append((k, v))
-        return HuffmanDataBlock(item_to_code, block_data)
-
-    def get_code_map(self, tree_root: Node):
-        code_map_raw = dict()
-        self._fill_code_map_recursively(code_map_raw, tree_root, [])
-        return code_map_raw
-
-    def _fill_code_map_recursively(self, code_map: dict, node: Node,
-                                   path_to_node: list):
+    def pop_block(self):
+        block = bytes(self.buffer[:self.block_length])
+        del self.buffer[:self.block_length]
+        return block
+
+    def encode_buffer(self, block: bytes, block_distribution=None):
+        if block_distribution is None:
+            block_distribution = self.calculate_distribution_in_buffer(block)
+        code_lengths = self.get_code_lengths(block_distribution)
+        return HuffmanDataBlock(code_lengths, block, block_distribution)
+
+    def get_code_lengths(self, distribution: dict):
+        """item -> code length, limited by max_code_length;
+        if tree is too deep, frequencies are flattened and tree is rebuilt"""
+        while True:
+            code_lengths = dict()
+            self._fill_code_lengths_recursively(code_lengths, self.build_tree(distribution), 0)
+            if max(code_lengths.values()) <= self.max_code_length:
+                return code_lengths
+            distribution = {k: (v >> 1) | 1 for k, v in distribution.items()}
+
+    def _fill_code_lengths_recursively(self, code_lengths: dict, node: Node, depth: int):
         if node is None:
             return
         if node.is_leaf:
-            cur_path = path_to_node.copy()
-            if len(cur_path) == 0:  # possible only if alphabet of 1 letter
-                cur_path.append(False)
-            code_map[node.value] = cur_path
+            # depth 0 possible only if alphabet of 1 letter
+            code_lengths[node.value] = max(depth, 1)
             return
-        # to left -> 0
-        path_to_node.append(False)
-        self._fill_code_map_recursively(code_map, node.left, path_to_node)
-        path_to_node.pop()
-        # to right -> 1
-        path_to_node.append(True)
-        self._fill_code_map_recursively(code_map, node.right, path_to_node)
-        path_to_node.pop()
+        self._fill_code_lengths_recursively(code_lengths, node.left, depth + 1)
+        self._fill_code_lengths_recursively(code_lengths, node.right, depth + 1)
         pass
 
     def build_tree(self, distribution: dict):
@@ -83,56 +89,232 @@ class HuffmanEncoderCore:
         _, _, root = heapq.heappop(p_queue)
         return root
 
-    def calculate_distribution_in_buffer(self):
-        distribution = dict()
-        for item in self.buffer:
-            if item in distribution:
-                distribution[item] += 1
-            else:
-                distribution[item] = 1
-        return distribution
+    def calculate_distribution_in_buffer(self, block: bytes):
+        """item -> count; counted by Counter in C"""
+        return Counter(block)
+    pass
+
 
-    def pump_to_buffer(self, iterator):
+class AdaptiveHuffmanEncoderCore(HuffmanEncoderCore):
+    """block is grown by segments of segment_length items while it pays off:
+    next lookahead_segments segments are compared as a part of the block and as
+    a block of their own (estimated by entropy and code table size);
+    new block starts when statistics shift enough to pay for a new table"""
+    # block type, items count, code lengths length, data length
+    block_header_bits = 11 * 8
+    code_length_bits = 5
+
+    def __init__(self, segment_length=4096, lookahead_segments=4, max_block_length=1024 * 1024):
+        super().__init__(max_block_length)
+        self.segment_length = segment_length
+        self.lookahead_segments = lookahead_segments
+        pass
+
+    def encode(self, chunk_iterator):
+        """generator itself
+        takes stream of bytes chunks; items of blocks are ints 0..255"""
         self.buffer.clear()
-        for _ in range(self.block_length):
-            try:
-                item = next(iterator)
-                self.buffer.append(item)
-            except StopIteration:
+        block_length = 0
+        block_distribution = Counter()
+        lookahead = deque()  # distributions of segments after block
+        lookahead_distribution = Counter()
+        lookahead_length = 0
+        chunk_iterator = iter(chunk_iterator)
+        stream_ended = False
+        while True:
+            # fill look ahead
+            while len(lookahead) < self.lookahead_segments:
+                start = block_length + lookahead_length
+                if len(self.buffer) - start < self.segment_length and not stream_ended:
+                    chunk = next(chunk_iterator, None)
+                    if chunk is None:
+                        stream_ended = True
+                    else:
+                        self.buffer += chunk
+                    continue
+                segment = self.buffer[start:start + self.segment_length]
+                if len(segment) == 0:
+                    break
+                segment_distribution = Counter(segment)
+                lookahead.append((len(segment), segment_distribution))
+                lookahead_distribution.update(segment_distribution)
+                lookahead_length += len(segment)
+            if len(lookahead) == 0:
                 break
+            segment_length, segment_distribution = lookahead.popleft()
+            lookahead_distribution.subtract(segment_distribution)
+            lookahead_length -= segment_length
+            if block_length > 0 and (block_length + segment_length > self.block_length or
+                                     self.is_split_better(block_distribution, segment_distribution,
+                                                          lookahead_distribution)):
+                yield self.encode_buffer(self.pop_block_of(block_length), block_distribution)
+                block_length = 0
+                block_distribution = Counter()
+            block_length += segment_length
+            block_distribution.update(segment_distribution)
+        if block_length > 0:
+            yield self.encode_buffer(self.pop_block_of(block_length), block_distribution)
         pass
 
+    def is_split_better(self, block_distribution, segment_distribution, lookahead_distribution):
+        """whether segment with look ahead after it is cheaper in a new block"""
+        ahead = segment_distribution + lookahead_distribution
+        joined_bits = self.estimate_block_bits(block_distribution + ahead)
+        split_bits = self.estimate_block_bits(block_distribution) + self.estimate_block_bits(ahead)
+        return split_bits < joined_bits
+
+    def estimate_block_bits(self, distribution: Counter):
+        """entropy of items plus code table; huffman code is at least 1 bit long"""
+        total = sum(distribution.values())
+        data_bits = sum(count * max(math.log2(total / count), 1)
+                        for count in distribution.values() if count > 0)
+        return data_bits + self.block_header_bits + self.code_length_bits * len(distribution)
+
+    def pop_block_of(self, length):
+        block = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        return block
     pass
 
 
 class HuffmanDataBlock:
-    def __init__(self, item_to_code: list, data: list):
-        self.item_to_code = item_to_code
+    def __init__(self, code_lengths: dict, data: bytes, distribution=None):
+        """code_lengths: item -> length of its canonical code
+        data: items of block
+        distribution: item -> count in data, if known"""
+        self.code_lengths = code_lengths
         self.data = data
+        self.distribution = distribution
         pass
 
+    def get_encoded_bit_count(self):
+        """length of coded data in bits or None if distribution is unknown"""
+        if self.distribution is None:
+            return None
+        return sum(count * self.code_lengths[item] for item, count in self.distribution.items())
+
+    pass
+
+
+def get_canonical_code_map(code_lengths: dict):
+    """item -> (code, code length)
+    shorter codes go first, codes of same length are ordered by items,
+    every next code is previous one + 1;
+    returned codes are bit reversed: first bit of code is the lowest bit,
+    as they go to bit stream"""
+    code_map = dict()
+    code = 0
+    previous_length = 0
+    for item, length in sorted(code_lengths.items(), key=lambda pair: (pair[1], pair[0])):
+        code <<= length - previous_length
+        code_map[item] = (reverse_bits(code, length), length)
+        code += 1
+        previous_length = length
+    return code_map
+
+
+def reverse_bits(value: int, bit_count: int):
+    result = 0
+    for _ in range(bit_count):
+        result = (result << 1) | (value & 1)
+        value >>= 1
+    return result
+
+
+class PackedHuffmanBlock:
+    """block as it is stored: codes and data packed into bytes
+    code_map: item -> (code, code length), first bit of code is the lowest
+    decoding stops after bit_count bits or item_count items
+    checksum: crc32 of decoded items, if known"""
+    def __init__(self, code_map: dict, packed_data: bytes, bit_count: int,
+                 item_count=None, checksum=None):
+        self.code_map = code_map
+        self.packed_data = packed_data
+        self.bit_count = bit_count
+        self.item_count = item_count
+        self.checksum = checksum
+        pass
+
+    pass
+
+
+class StoredBlock:
+    """block kept as it is, without coding
+    checksum: crc32 of data, if known"""
+    def __init__(self, data: bytes, checksum=None):
+        self.data = data
+        self.checksum = checksum
+        pass
+
+    pass
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def check_checksum(data, checksum, what='block'):
+    """checksum None == nothing to check"""
+    if checksum is not None and zlib.crc32(data) != checksum:
+        raise ChecksumError(f'{what} checksum mismatch (damaged data or wrong password)')
     pass
 
 
 class HuffmanDecoderCore:
-    def decode(self, iterator, hasher=None):
-        """generator itself"""
-        for block in iterator:
-            for item in self.decode_block(block, hasher):
-                yield item
+    """table driven decoder
+    peeks lookup_bits bits and gets item and code length from a table;
+    longer codes are found in secondary tables"""
+    def __init__(self, lookup_bits=9):
+        self.lookup_bits = lookup_bits
         pass
 
-    def decode_block(self, block: HuffmanDataBlock, hasher=None):
-        code_to_item = dict()
-        if hasher is None:
-            hasher = lambda x: x
-        for item, c in block.item_to_code:
-            code = hasher(c)
-            code_to_item[code] = item
-        for c in block.data:
-            code = hasher(c)
-            yield code_to_item[code]
+    def decode(self, iterator):
+        """generator itself
+        takes PackedHuffmanBlock and StoredBlock sequence, yields whole decoded block at once"""
+        for block in iterator:
+            yield self.decode_block(block)
         pass
 
+    def decode_block(self, block: PackedHuffmanBlock | StoredBlock):
+        """returns all items of block as one bytes-like object and checks its checksum;
+        data of StoredBlock goes through as it is"""
+        if isinstance(block, StoredBlock):
+            output = block.data
+        else:
+            output = self.unpack_block(block)
+        check_checksum(output, block.checksum)
+        return output
 
+    def unpack_block(self, block: PackedHuffmanBlock):
+        """bytearray of item_count items; legacy blocks without item_count end by bit_count"""
+        table = self.build_lookup_table(block.code_map)
+        # every code is at least 1 bit long
+        max_count = block.bit_count if block.item_count is None else block.item_count
+        output = BitReader(block.packed_data).read_prefix_codes(
+            table, self.lookup_bits, max_count, block.bit_count)
+        if block.item_count is not None and len(output) != block.item_count:
+            raise ValueError('data ended in the middle of block')
+        return output
 
+    def build_lookup_table(self, code_map: dict):
+        """table for BitReader.read_prefix_codes"""
+        lookup_bits = self.lookup_bits
+        table = [(None, 0)] * (1 << lookup_bits)
+        long_codes = dict()  # lowest lookup_bits bits -> [(rest, rest_length, item)]
+        for item, (code, length) in code_map.items():
+            if length <= lookup_bits:
+                for index in range(code, 1 << lookup_bits, 1 << length):
+                    table[index] = (item, length)
+            else:
+                prefix = code & ((1 << lookup_bits) - 1)
+                long_codes.setdefault(prefix, []).append(
+                    (code >> lookup_bits, length - lookup_bits, item))
+        for prefix, codes in long_codes.items():
+            sub_bits = max(rest_length for _, rest_length, _ in codes)
+            sub_table = [(None, 0)] * (1 << sub_bits)
+            for rest, rest_length, item in codes:
+                for index in range(rest, 1 << sub_bits, 1 << rest_length):
+                    sub_table[index] = (item, lookup_bits + rest_length)
+            table[prefix] = ((sub_table, (1 << sub_bits) - 1), lookup_bits + sub_bits)
+        return table
+    pass
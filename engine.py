@@ -1,18 +1,42 @@
 from pathlib import Path
 import pickle
 from byte_level_algorithms import file_handler
-from core_algorithms.LZ77_core import LZ77EncoderCore, LZ77DecoderCore
-from byte_level_algorithms.LZ77Record_to_bytes_converter import LZ77RecordToBytesConverter
-from core_algorithms.huffman_core import HuffmanEncoderCore, HuffmanDecoderCore
-from byte_level_algorithms.simple_huffman_bytes_converters import SimpleHuffmanBlockToBytesConverter, SimpleBytesToHuffmanBlockConverter
-from byte_level_algorithms.cypher_stream import CypherStream
+from core_algorithms.LZ77_core import LZ77EncoderCore, LZ77DecoderCore, DEFAULT_MAX_CHAIN_LENGTH, DEFAULT_PARSE
+from byte_level_algorithms.LZ77Record_to_bytes_converter import LZ77RecordToBytesConverter, \
+    LZ77VarintRecordToBytesConverter
+from core_algorithms.huffman_core import AdaptiveHuffmanEncoderCore, HuffmanDecoderCore, ChecksumError
+from byte_level_algorithms.simple_huffman_bytes_converters import SimpleBytesToHuffmanBlockConverter
+from byte_level_algorithms.canonical_huffman_bytes_converters import CanonicalHuffmanBlockToBytesConverter, BytesToCanonicalHuffmanBlockConverter
+from byte_level_algorithms.cypher_stream import CypherStream, KeystreamCypherStream
+from byte_level_algorithms.central_directory import CentralDirectory, DirectoryEntry, IS_DIR_FLAG, \
+    IS_STORED_FLAG, encode_central_directory, is_central_directory
 import struct
-from byte_bit_buffer import ByteBitBuffer
+from chunk_stream import DEFAULT_CHUNK_SIZE
 from itertools import chain
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from contextlib import nullcontext
+import math
 import hashlib
+import os
+import sys
+import zlib
+
+
+STANDARD_STREAM = '-'  # path of stdin as source and stdout as destination
+FOOTER_MAGIC = b'DFFT'
+# decoding of damaged data (or data with wrong password) fails with one of them;
+# ChecksumError is ValueError
+DAMAGED_DATA_ERRORS = (ValueError, EOFError, IndexError, KeyError, struct.error, pickle.UnpicklingError)
+# file that failed to decode or did not fit into writing limit is removed
+DECOMPRESSION_ERRORS = DAMAGED_DATA_ERRORS + (file_handler.WritingLimitError,)
 
 
 class FileInfo:
+    is_stored = False  # data is copied without compression
+    checksum = None  # crc32 of file content; unknown in old archives
+
     def __init__(self, name, path, start_position_bytes=None, length_bytes=None):
         self.name = name
         self.path = Path(path)
@@ -78,21 +102,69 @@ def construct_file_info(path):
 
 def construct_tree(path):
     path = Path(path)
+    if is_standard_stream(path):
+        # size is known only after reading
+        return DirInfo('stdin', [FileInfo('stdin', path)], [])
     if path.is_dir():
         return construct_dir_tree(path)
-    return DirInfo(path.name[:-len(path.suffix)], [construct_file_info(path)], [])
+    return DirInfo(path.stem, [construct_file_info(path)], [])
+
+
+def is_standard_stream(path):
+    return str(path) == STANDARD_STREAM
 
 
 def decode_tree(tree_bytes, root_path):
-    tree: DirInfo = pickle.loads(tree_bytes)
-    tree.set_new_file_paths(root_path)
+    """reads binary directory, or pickled tree of old archives"""
+    if not is_central_directory(tree_bytes):
+        tree: DirInfo = pickle.loads(tree_bytes)
+        tree.set_new_file_paths(root_path)
+        return tree
+    directory = CentralDirectory(tree_bytes)
+    tree = DirInfo(directory.root_name, [], [])
+    dirs = {'': tree}
+    for entry in directory:
+        # entries are sorted, so directory goes before its content
+        parent = dirs[entry.path.rpartition('/')[0]]
+        if entry.is_dir:
+            dirs[entry.path] = DirInfo(entry.name, [], [])
+            parent.dirs.append(dirs[entry.path])
+        else:
+            parent.files.append(make_file_info(entry, root_path, directory.root_name))
     return tree
 
 
 def encode_tree(tree: DirInfo):
-    tree.remove_all_file_paths()
-    tree_s = pickle.dumps(tree)
-    return tree_s
+    return encode_central_directory(tree.name, get_directory_entries(tree))
+
+
+def get_directory_entries(tree: DirInfo, prefix=''):
+    entries = []
+    for f in tree.files:
+        entries.append(DirectoryEntry(prefix + f.name, f.start_position_bytes, f.length_bytes,
+                                      f.initial_size or 0, IS_STORED_FLAG if f.is_stored else 0,
+                                      f.checksum))
+    for d in tree.dirs:
+        entries.append(DirectoryEntry(prefix + d.name, flags=IS_DIR_FLAG))
+        entries += get_directory_entries(d, prefix + d.name + '/')
+    return entries
+
+
+def make_file_info(entry: DirectoryEntry, root_path, root_name):
+    path = get_output_path(root_path, root_name, entry.path)
+    file_info = FileInfo(entry.name, path, entry.start_position_bytes, entry.length_bytes)
+    file_info.initial_size = entry.initial_size
+    file_info.is_stored = entry.is_stored
+    file_info.checksum = entry.checksum
+    return file_info
+
+
+def get_output_path(root_path, root_name, entry_path: str):
+    """where entry of archive goes; raises ValueError if it is not inside root_path"""
+    path = Path(root_path, root_name, *entry_path.split('/'))
+    if not path.resolve().is_relative_to(Path(root_path).resolve()):
+        raise ValueError(f'path {entry_path!r} of archive goes outside of {root_path}')
+    return path
 
 
 # def tree_serialization_test():
@@ -111,7 +183,7 @@ class PasswordRequiredError(Exception):
 class FlagsHandler:
     def __init__(self, flags_byte: bytes):
         if len(flags_byte) != 1:
-            ValueError('wrong flags arg')
+            raise ValueError('wrong flags arg')
         self.flags_num = flags_byte[0]
         pass
 
@@ -123,6 +195,32 @@ class FlagsHandler:
     def use_LZ77(self):
         return self.contain(2)
 
+    @property
+    def use_canonical_huffman(self):
+        return self.contain(3)
+
+    @property
+    def use_keystream_cypher(self):
+        """KeystreamCypherStream instead of legacy CypherStream"""
+        return self.contain(4)
+
+    @property
+    def encrypt_after_compression(self):
+        """cypher is applied to compressed data, its keystream position is position in archive;
+        in old archives it was applied to files before compression"""
+        return self.contain(5)
+
+    @property
+    def use_checksums(self):
+        """every huffman block ends with crc32 of its data"""
+        return self.contain(6)
+
+    @property
+    def use_varint_lz77_records(self):
+        """LZ77 records of LZ77VarintRecordToBytesConverter with big window;
+        in old archives records keep lookback index and length in one byte"""
+        return self.contain(7)
+
     def contain(self, flag_num):
         return (self.flags_num & 1 << flag_num) != 0
 
@@ -138,162 +236,636 @@ class FlagsHandler:
 class Engine:
     int_format = '>I'
     compressed_file_extension = '.defish'
-
-    def __init__(self, src, dst_folder=None, password=None, use_lz77=False, writing_limit_megabytes=None):
+    lz77_window_width = 32 * 1024
+    lz77_max_length = 258
+    legacy_lz77_window_width = 255  # one byte records keep lookback index and length
+    # huffman blocks grow by segments until a new code table pays off
+    huffman_segment_length = 4096
+    huffman_max_block_length = 1024 * 1024
+    # files whose samples have higher order-0 entropy are stored without compression,
+    # coding could save only about 3% of them
+    incompressible_entropy_bits = 7.75
+    entropy_sample_count = 4
+    entropy_sample_size = 4096
+    # keystream cypher: random salt of every archive and key derivation from password
+    salt_length = 16
+    key_derivation_iterations = 200_000
+
+    def __init__(self, src, dst_folder=None, password=None, use_lz77=False, writing_limit_megabytes=None,
+                 chunk_size_bytes=DEFAULT_CHUNK_SIZE, lz77_max_chain_length=None, jobs=None,
+                 piece_size_bytes=None, profiler=None, lz77_parse=None):
         self.src = Path(src)
         if dst_folder is None:
             self.dst_folder = self.src
         else:
             self.dst_folder = Path(dst_folder)
 
-        if writing_limit_megabytes is None:
+        if writing_limit_megabytes is None and not is_standard_stream(self.dst_folder):
             writing_limit_megabytes = 3
-        self.writing_limit_bytes = writing_limit_megabytes * 1024 * 1024
+        # None == no limit; archive written to stdout is not limited by default
+        self.writing_limit_bytes = None if writing_limit_megabytes is None \
+            else writing_limit_megabytes * 1024 * 1024
+        self.chunk_size_bytes = chunk_size_bytes
+
+        if lz77_max_chain_length is None:
+            lz77_max_chain_length = DEFAULT_MAX_CHAIN_LENGTH
+        self.lz77_max_chain_length = lz77_max_chain_length
+
+        if lz77_parse is None:
+            lz77_parse = DEFAULT_PARSE
+        self.lz77_parse = lz77_parse
+
+        if jobs is None:
+            jobs = 1
+        self.jobs = jobs
+
+        if piece_size_bytes is None:
+            # whole huffman segments
+            piece_size_bytes = 1024 * self.huffman_segment_length
+        self.piece_size_bytes = piece_size_bytes
 
         self.flags_handler = FlagsHandler(b'\x00')
         if password is not None:
             self.flags_handler.change(1)
+            self.flags_handler.change(4)
+            self.flags_handler.change(5)
         if use_lz77:
             self.flags_handler.change(2)
-
-
-        self.cypher = CypherStream(self.hash_password(password))
+            self.flags_handler.change(7)
+        self.flags_handler.change(3)
+        self.flags_handler.change(6)
+
+        self.password = password
+        self.salt = os.urandom(self.salt_length) if self.flags_handler.use_keystream_cypher else b''
+        # key derivation is slow: cypher is made by compress, or by read_flags with salt of archive
+        self.cypher = None
+
+        # profiling.Profiler or None
+        self.profiler = profiler
+        # files are profiled by path relative to it, that is path inside archive
+        self.members_root = self.src if self.src.is_dir() else self.src.parent
         pass
 
     def compress(self):
         """
         -flags 1B
-        -tree_pointer 4B
+        -tree_pointer 4B (0 == tree is found by footer; in old archives it points to tree)
+        -salt 16B (only with keystream cypher)
         -data ?B
         -tree_length_in_bytes 4B
-        -Tree
+        -Tree (binary directory, see CentralDirectory; pickled DirInfo in old archives)
+        -Footer (not in old archives)
+        --tree_pointer 8B
+        --magic 4B == DFFT
+        archive is written in one pass, so it can go to a pipe
+        archive that does not fit into writing limit is not written; WritingLimitError is raised
         """
         if self.flags_handler.use_password:
-            print('compressing with password')
+            print('compressing with password', file=self.get_message_stream())
 
         flags = self.flags_handler.to_byte()
+        self.cypher = self.make_cypher()
 
-        tree_pointer_mock = [b'\x00', b'\x00', b'\x00', b'\x00']
+        tree_pointer_by_footer = b'\x00' * 4
 
         tree = construct_tree(self.src)
         files = tree.get_all_files()
 
-        compressed_data_stream = chain([flags] + tree_pointer_mock,
-                                       self.make_one_big_files_stream(5, files),
-                                       self.make_encoded_tree_stream(tree))
+        compressed_data_stream = chain([flags + tree_pointer_by_footer + self.salt],
+                                       self.make_one_big_files_stream(self.get_data_offset(), files),
+                                       self.make_encoded_tree_stream(tree, files))
 
+        if is_standard_stream(self.dst_folder):
+            with self.profile_section('write'):
+                file_handler.write_to_stream_limited(sys.stdout.buffer, compressed_data_stream,
+                                                     self.writing_limit_bytes, strict=True)
+                sys.stdout.buffer.flush()
+            return
         dst_path = Path(self.dst_folder, tree.name + self.compressed_file_extension)
-        file_handler.write_to_file_limited(dst_path, compressed_data_stream, self.writing_limit_bytes)
+        with self.profile_section('write', dst_path):
+            try:
+                file_handler.write_to_file_limited(dst_path, compressed_data_stream, self.writing_limit_bytes,
+                                                   strict=True)
+            except file_handler.WritingLimitError:
+                dst_path.unlink()
+                raise
+        pass
 
-        tree_pointer_int = 5
+    def make_encoded_tree_stream(self, tree, files: list):
+        """tree, then footer; runs after all files are compressed"""
+        tree_pointer = self.get_data_offset()
         if len(files) > 0:
             last_file: FileInfo = files[-1]
-            tree_pointer_int = last_file.start_position_bytes + last_file.length_bytes
-
-        with open(dst_path, 'rb+') as f:
-            f.seek(1)
-            f.write(struct.pack(self.int_format, tree_pointer_int))
+            tree_pointer = last_file.start_position_bytes + last_file.length_bytes
+        with self.profile_section('directory'):
+            enc_tree = encode_tree(tree)
+        yield b''.join([struct.pack(self.int_format, len(enc_tree)), enc_tree,
+                        struct.pack('>Q', tree_pointer), FOOTER_MAGIC])
         pass
 
-    def make_encoded_tree_stream(self, tree):
-        enc_tree = encode_tree(tree)
-        buffer = ByteBitBuffer()
-        buffer.append_bytes_str(struct.pack(self.int_format, len(enc_tree)))
-        buffer.append_bytes_str(enc_tree)
-        while buffer.has_bytes():
-            yield buffer.pop_byte()
-        pass
+    def get_message_stream(self):
+        """messages must not get into archive written to stdout"""
+        return sys.stderr if is_standard_stream(self.dst_folder) else sys.stdout
 
     def make_one_big_files_stream(self, offset: int, files_info: list):
         current_start_position = offset
-        for f in files_info:
+        for f, compressed_stream in zip(files_info, self.make_compressed_files_streams(files_info)):
             f: FileInfo = f
             length = 0
-            for byte in self.make_compressed_file_stream(f.path):
-                length += 1
-                yield byte
+            if self.flags_handler.use_password:
+                self.cypher.seek(current_start_position)
+                compressed_stream = self.profile('cypher', self.cypher.encode(compressed_stream), f.path)
+            for chunk in compressed_stream:
+                length += len(chunk)
+                yield chunk
             f.set_position_info(current_start_position, length)
             current_start_position += length
         pass
 
-    def make_compressed_file_stream(self, filepath):
-        filepath = Path(filepath)
+    def make_compressed_files_streams(self, files_info: list):
+        """one stream of compressed chunks per file, in order of files
+        with several jobs pieces of files are compressed in worker processes,
+        output is the same as in one process"""
+        for f in files_info:
+            with self.profile_section('entropy_sampling', f.path):
+                f.is_stored = self.is_incompressible(f.path)
+        if self.jobs <= 1 or is_standard_stream(self.src):
+            for f in files_info:
+                # size and checksum are counted from data as it is compressed
+                f.initial_size = 0
+                f.checksum = 0
+                if is_standard_stream(f.path):
+                    yield self.make_compressed_data_stream(self.make_standard_input_stream(f), b'', f.path)
+                elif f.is_stored:
+                    yield self.make_stored_file_stream(f.path, f)
+                else:
+                    yield self.make_compressed_file_stream(f.path, f)
+            return
+        pieces_starts = [range(0) if f.is_stored else self.get_pieces_starts(f.path) for f in files_info]
+        tasks = ((compress_piece_job, self, f.path, start)
+                 for f, starts in zip(files_info, pieces_starts) for start in starts)
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            # limits amount of finished pieces kept in memory
+            results = run_ordered(pool, tasks, ahead=2 * self.jobs)
+            for f, starts in zip(files_info, pieces_starts):
+                if f.is_stored:
+                    f.initial_size = 0
+                    f.checksum = 0
+                    yield self.make_stored_file_stream(f.path, f)
+                else:
+                    self.set_checksum(f)
+                    yield self.profile('waiting_for_workers',
+                                       (self.take_job_result(*next(results)) for _ in starts), f.path)
+        pass
 
-        input_byte_stream = file_handler.read_file_stream(file_path=filepath)
+    def set_checksum(self, file_info: FileInfo):
+        """crc32 of whole file, checked after decompression
+        pieces of file are read in worker processes, and zlib can not combine
+        crc32 of pieces, so the file is read once more; if it changes in between,
+        its checksum does not match on decompression"""
+        with self.profile_section('checksum', file_info.path):
+            checksum = 0
+            for chunk in file_handler.read_file_stream(file_info.path, chunk_size=self.chunk_size_bytes):
+                checksum = zlib.crc32(chunk, checksum)
+        file_info.checksum = checksum
+        pass
 
-        current_stream = input_byte_stream
-        if self.flags_handler.use_password:
-            # print('compressing with password')
-            current_stream = self.cypher.encode(current_stream)
+    def is_incompressible(self, filepath):
+        """estimates order-0 entropy of a few samples from the inside of file;
+        small files and stdin are never treated as incompressible"""
+        if is_standard_stream(filepath):
+            return False
+        size = Path(filepath).stat().st_size
+        sample_count, sample_size = self.entropy_sample_count, self.entropy_sample_size
+        if size < sample_count * sample_size:
+            return False
+        entropies = []
+        for i in range(sample_count):
+            start = (i + 1) * size // (sample_count + 1) - sample_size // 2
+            sample = b''.join(file_handler.read_file_segment_stream(filepath, start, sample_size))
+            entropies.append(get_entropy_bits(sample))
+        return sum(entropies) / sample_count >= self.incompressible_entropy_bits
+
+    def make_standard_input_stream(self, file_info: FileInfo):
+        """chunks of stdin; counts initial size and checksum of file"""
+        return self.make_counted_stream(self.profile(
+            'read', file_handler.read_binary_stream(sys.stdin.buffer, self.chunk_size_bytes), file_info.path),
+            file_info)
+
+    def make_counted_stream(self, stream, file_info: FileInfo):
+        """chunks of stream; adds them to initial size and checksum of file"""
+        for chunk in stream:
+            file_info.initial_size += len(chunk)
+            file_info.checksum = zlib.crc32(chunk, file_info.checksum)
+            yield chunk
+        pass
+
+    def make_stored_file_stream(self, filepath, file_info: FileInfo = None):
+        """file_info: if given, initial size and checksum are counted into it"""
+        stream = self.profile('read', file_handler.read_file_stream(filepath, chunk_size=self.chunk_size_bytes),
+                              filepath)
+        if file_info is not None:
+            stream = self.make_counted_stream(stream, file_info)
+        return stream
+
+    def make_compressed_file_stream(self, filepath, file_info: FileInfo = None):
+        """file is cut into pieces of piece_size_bytes, that are compressed
+        independently; their compressed data goes one after another
+        file_info: if given, initial size and checksum are counted into it"""
+        for start in self.get_pieces_starts(filepath):
+            for chunk in self.make_compressed_piece_stream(filepath, start, file_info):
+                yield chunk
+        pass
+
+    def get_pieces_starts(self, filepath):
+        return range(0, max(Path(filepath).stat().st_size, 1), self.piece_size_bytes)
 
+    def make_compressed_piece_stream(self, filepath, start, file_info: FileInfo = None):
+        filepath = Path(filepath)
+
+        input_byte_stream = self.profile('read', file_handler.read_file_segment_stream(
+            filepath, start, self.piece_size_bytes, chunk_size=self.chunk_size_bytes), filepath)
+        if file_info is not None:
+            input_byte_stream = self.make_counted_stream(input_byte_stream, file_info)
+        history = b''
+        if self.flags_handler.use_LZ77:
+            # window starts filled with the end of previous piece
+            history_start = max(start - self.get_lz77_window_width(), 0)
+            history = b''.join(file_handler.read_file_segment_stream(filepath, history_start,
+                                                                     start - history_start))
+        return self.make_compressed_data_stream(input_byte_stream, history, filepath)
+
+    def make_compressed_data_stream(self, input_byte_stream, history: bytes, filepath):
+        """history: data before input, it fills LZ77 window"""
+        current_stream = input_byte_stream
         if self.flags_handler.use_LZ77:
-            window_width = 50
             compressed_record_stream = \
-                LZ77EncoderCore(window_width, window_width).encode(
-                    input_byte_stream)
+                LZ77EncoderCore(self.get_lz77_window_width(), self.get_lz77_max_length(),
+                                self.lz77_max_chain_length, self.lz77_parse).encode(input_byte_stream, history)
             compressed_byte_stream = \
-                LZ77RecordToBytesConverter().encode(compressed_record_stream)
-            current_stream = compressed_byte_stream
+                self.make_lz77_record_converter().encode(compressed_record_stream)
+            current_stream = self.profile('lz77', compressed_byte_stream, filepath)
 
-        block_len = 10000
-        huffman_blocks_stream = HuffmanEncoderCore(block_len).encode(
-            current_stream)
-        encoded_bytes_stream = SimpleHuffmanBlockToBytesConverter().encode(
-            huffman_blocks_stream)
-        return encoded_bytes_stream
+        huffman_blocks_stream = AdaptiveHuffmanEncoderCore(
+            self.huffman_segment_length, max_block_length=self.huffman_max_block_length).encode(current_stream)
+        encoded_bytes_stream = CanonicalHuffmanBlockToBytesConverter(
+            use_checksums=self.flags_handler.use_checksums).encode(
+            self.profile('huffman_blocks', huffman_blocks_stream, filepath))
+        return self.profile('huffman_packing', encoded_bytes_stream, filepath)
 
     def decompress(self):
-        self.read_flags()
+        try:
+            directory, folders, files = self.read_members()
+        except DAMAGED_DATA_ERRORS as e:
+            return [(None, get_error_message(e))]
         if self.flags_handler.use_password:
             print('decompressing with password')
 
-        tree = self.read_dir_tree()
-        files = tree.get_all_files()
+        for folder in folders:
+            folder.mkdir(parents=True, exist_ok=True)
+        return self.decompress_files(directory, files)
+
+    def extract(self, patterns):
+        """decompresses only files whose path inside archive
+        (like 'subfolder/cat.png') matches one of glob patterns, path of folder matches files in it;
+        raises MembersNotFoundError if some pattern matches no file
+        returns list of (FileInfo, error message or None), see decompress_files"""
+        try:
+            directory, _, files = self.read_members(patterns)
+        except DAMAGED_DATA_ERRORS as e:
+            return [(None, get_error_message(e))]
+        return self.decompress_files(directory, files)
+
+    def test(self):
+        """decodes every file without writing it and checks checksums;
+        returns list of (FileInfo, error message or None);
+        if archive directory can not be read, the only FileInfo is None"""
+        try:
+            directory, _, files = self.read_members()
+        except DAMAGED_DATA_ERRORS as e:
+            return [(None, get_error_message(e))]
+        if self.jobs <= 1 or self.encrypts_files_before_compression():
+            keystream_positions = self.get_keystream_positions(directory)
+            results = []
+            for file in files:
+                if self.encrypts_files_before_compression():
+                    self.cypher.seek(keystream_positions[file.start_position_bytes])
+                results.append((file, self.test_file(file)))
+            return results
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [pool.submit(test_file_job, self, f) for f in files]
+            return [(f, self.take_job_result(*future.result())) for f, future in zip(files, futures)]
+
+    def read_members(self, patterns=None):
+        """reads flags and directory, every entry of it is checked
+        returns directory, output paths of its folders and FileInfo of its files;
+        with patterns only files that match them, see CentralDirectory.find_matching_files
+        raises one of DAMAGED_DATA_ERRORS if archive directory can not be read"""
+        self.read_flags()
+        directory = self.read_central_directory()
+        entries = list(directory)
+        if patterns is not None:
+            entries = directory.find_matching_files(patterns)
+        folders = [get_output_path(self.dst_folder, directory.root_name, e.path) for e in entries if e.is_dir]
+        files = [make_file_info(e, self.dst_folder, directory.root_name) for e in entries if not e.is_dir]
+        self.members_root = Path(self.dst_folder, directory.root_name)
+        return directory, folders, files
+
+    def test_file(self, file: FileInfo):
+        """error message, or None if file is fine"""
+        try:
+            with self.profile_section('test', file.path):
+                deque(self.make_decompressed_file_stream(self.src, file), maxlen=0)
+        except DAMAGED_DATA_ERRORS as e:
+            return get_error_message(e)
+        return None
+
+    def decompress_files(self, directory: CentralDirectory, files: list):
+        """files: FileInfo of files of directory to decompress
+        returns list of (FileInfo, error message or None);
+        files that failed to decode are removed"""
+        for file in files:
+            file.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.jobs <= 1 or self.encrypts_files_before_compression():
+            keystream_positions = self.get_keystream_positions(directory)
+            results = []
+            for file in files:
+                if self.encrypts_files_before_compression():
+                    self.cypher.seek(keystream_positions[file.start_position_bytes])
+                results.append((file, self.decompress_file(file)))
+            return results
+        return self.decompress_files_in_parallel(files)
+
+    def encrypts_files_before_compression(self):
+        """old archives: cypher keystream goes through all files one after another,
+        so they are decoded in one process;
+        with LZ77 output of cypher was not used, such files are not encrypted"""
+        return self.flags_handler.use_password and not self.flags_handler.encrypt_after_compression \
+            and not self.flags_handler.use_LZ77
+
+    def get_keystream_positions(self, directory: CentralDirectory):
+        """old archives: start of file data -> where its keystream starts"""
+        positions = dict()
+        position = 0
+        files = sorted((e for e in directory if not e.is_dir),
+                       key=lambda e: e.start_position_bytes)
         for file in files:
-            file: FileInfo = file
-            output_bytes_stream =\
-                self.make_decompressed_file_stream(self.src, file.start_position_bytes, file.length_bytes)
-            folder = file.path.parent
-            if not folder.exists():
-                folder.mkdir()
-            self.writing_limit_bytes =\
-                file_handler.write_to_file_limited(file_path = file.path,
-                                                   sequence=output_bytes_stream,
-                                                   limit_in_bytes=self.writing_limit_bytes)
+            positions.setdefault(file.start_position_bytes, position)
+            position += file.initial_size
+        return positions
+
+    def decompress_file(self, file: FileInfo):
+        """error message, or None if file is fine; file that failed is removed"""
+        output_bytes_stream = self.make_decompressed_file_stream(self.src, file)
+        try:
+            with self.profile_section('write', file.path):
+                self.writing_limit_bytes =\
+                    file_handler.write_to_file_limited(file_path=file.path,
+                                                       sequence=output_bytes_stream,
+                                                       limit_in_bytes=self.writing_limit_bytes,
+                                                       strict=True)
+        except DECOMPRESSION_ERRORS as e:
+            file.path.unlink(missing_ok=True)
+            return get_error_message(e)
+        return None
+
+    def decompress_files_in_parallel(self, files: list):
+        """every worker reads its members from archive and writes its files;
+        biggest members go first, so no big one is left for the end
+        returns list of (FileInfo, error message or None) in order of files"""
+        writing_limit = file_handler.SharedWritingLimit(self.writing_limit_bytes)
+        order = sorted(range(len(files)), key=lambda i: files[i].length_bytes, reverse=True)
+        errors = [None] * len(files)
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=set_shared_writing_limit,
+                                 initargs=(writing_limit,)) as pool:
+            futures = [(i, pool.submit(decompress_file_job, self, files[i])) for i in order]
+            for i, future in futures:
+                errors[i] = self.take_job_result(*future.result())
+        self.writing_limit_bytes = writing_limit.get_left()
+        return list(zip(files, errors))
+
+    def make_decompressed_file_stream(self, archive_file_path, file: FileInfo):
+        encoded_bytes_stream = self.profile('read', file_handler.read_file_segment_stream(
+            archive_file_path, file.start_position_bytes, file.length_bytes, chunk_size=self.chunk_size_bytes),
+            file.path)
+        if self.flags_handler.use_password and self.flags_handler.encrypt_after_compression:
+            self.cypher.seek(file.start_position_bytes)
+            encoded_bytes_stream = self.profile('cypher', self.cypher.decode(encoded_bytes_stream), file.path)
+        if file.is_stored:
+            current_stream = encoded_bytes_stream
+        else:
+            current_stream = self.make_decoded_data_stream(encoded_bytes_stream, file.path)
+
+        if self.encrypts_files_before_compression():
+            current_stream = self.profile('cypher', self.cypher.decode(current_stream), file.path)
+        if file.checksum is not None:
+            current_stream = self.make_checked_stream(current_stream, file)
+        return current_stream
+
+    def make_checked_stream(self, stream, file: FileInfo):
+        """chunks of stream; raises ChecksumError at the end
+        if size or crc32 of stream differs from what directory says"""
+        size = 0
+        checksum = 0
+        for chunk in stream:
+            size += len(chunk)
+            checksum = zlib.crc32(chunk, checksum)
+            yield chunk
+        if size != file.initial_size or checksum != file.checksum:
+            raise ChecksumError(f'{file.name}: checksum mismatch, wrong password or damaged archive')
         pass
 
-    def make_decompressed_file_stream(self, archive_file_path, start_pos, length):
-        encoded_bytes_stream = file_handler.read_file_segment_stream(archive_file_path, start_pos, length)
-        huffman_blocks_stream = SimpleBytesToHuffmanBlockConverter().decode(encoded_bytes_stream)
-        current_stream = HuffmanDecoderCore().decode(huffman_blocks_stream)
+    def make_decoded_data_stream(self, encoded_bytes_stream, filepath=''):
+        if self.flags_handler.use_canonical_huffman:
+            huffman_blocks_stream = BytesToCanonicalHuffmanBlockConverter(
+                use_checksums=self.flags_handler.use_checksums).decode(encoded_bytes_stream)
+        else:
+            huffman_blocks_stream = SimpleBytesToHuffmanBlockConverter().decode(encoded_bytes_stream)
+        huffman_blocks_stream = self.profile('huffman_blocks', huffman_blocks_stream, filepath)
+        current_stream = self.profile('huffman_decode', HuffmanDecoderCore().decode(huffman_blocks_stream),
+                                      filepath)
 
         if self.flags_handler.use_LZ77:
-            compressed_record_stream = LZ77RecordToBytesConverter().decode(current_stream)
-            current_stream = LZ77DecoderCore(window_width=50).decode(compressed_record_stream)
-
-        if self.flags_handler.use_password:
-            current_stream = self.cypher.decode(current_stream)
+            compressed_record_stream = self.make_lz77_record_converter().decode(current_stream)
+            current_stream = LZ77DecoderCore(window_width=self.get_lz77_window_width(),
+                                             chunk_size=self.chunk_size_bytes).decode(compressed_record_stream)
+            current_stream = self.profile('lz77_decode', current_stream, filepath)
         return current_stream
 
+    def get_lz77_window_width(self):
+        if self.flags_handler.use_varint_lz77_records:
+            return self.lz77_window_width
+        return self.legacy_lz77_window_width
+
+    def get_lz77_max_length(self):
+        if self.flags_handler.use_varint_lz77_records:
+            return self.lz77_max_length
+        return self.legacy_lz77_window_width
+
+    def make_lz77_record_converter(self):
+        if self.flags_handler.use_varint_lz77_records:
+            return LZ77VarintRecordToBytesConverter(self.chunk_size_bytes)
+        return LZ77RecordToBytesConverter(self.chunk_size_bytes)
+
+    def profile(self, stage: str, stream, filepath=''):
+        """stream measured by profiler; stream itself if profiling is off"""
+        if self.profiler is None:
+            return stream
+        return self.profiler.wrap(stage, stream, self.get_member_path(filepath))
+
+    def profile_section(self, stage: str, filepath=''):
+        """context manager measuring a section of code as stage"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.measure(stage, self.get_member_path(filepath))
+
+    def get_member_path(self, filepath):
+        """path inside archive, like 'subfolder/cat.png'; name for files outside of it (archive itself)"""
+        if filepath == '':
+            return ''
+        filepath = Path(filepath)
+        if filepath.is_relative_to(self.members_root):
+            return filepath.relative_to(self.members_root).as_posix()
+        return filepath.name
+
+    def take_job_result(self, result, profiler_state):
+        """merges what worker process measured"""
+        if self.profiler is not None and profiler_state is not None:
+            self.profiler.merge(profiler_state)
+        return result
+
     def read_dir_tree(self):
+        return decode_tree(self.read_directory_bytes(), self.dst_folder)
+
+    def read_central_directory(self):
+        """pickled tree of old archives is converted to binary directory"""
+        directory_bytes = self.read_directory_bytes()
+        if not is_central_directory(directory_bytes):
+            return CentralDirectory(encode_tree(decode_tree(directory_bytes, self.dst_folder)),
+                                    allow_empty_root_name=True)
+        return CentralDirectory(directory_bytes)
+
+    def read_directory_bytes(self):
+        self.check_archive_is_seekable()
         with open(self.src, 'rb') as f:
             flags = f.read(1)
             tree_pointer = struct.unpack(self.int_format, f.read(4))[0]
+            if tree_pointer == 0:
+                f.seek(-12, 2)
+                tree_pointer, magic = struct.unpack('>Q4s', f.read(12))
+                if magic != FOOTER_MAGIC:
+                    raise ValueError('archive footer not found; archive is not complete')
             f.seek(tree_pointer)
             tree_length = struct.unpack(self.int_format, f.read(4))[0]
-            tree_bytes_str = f.read(tree_length)
-        return decode_tree(tree_bytes_str, self.dst_folder)
+            return f.read(tree_length)
+
+    def check_archive_is_seekable(self):
+        if is_standard_stream(self.src):
+            raise ValueError('archive can not be read from stdin: its directory is at the end; '
+                             'save it to file first')
+        pass
 
     def read_flags(self):
+        """reads flags and salt"""
+        self.check_archive_is_seekable()
         with open(self.src, 'rb') as f:
             flags = f.read(1)
-        self.flags_handler = FlagsHandler(flags)
+            self.flags_handler = FlagsHandler(flags)
+            self.salt = b''
+            if self.flags_handler.use_keystream_cypher:
+                f.seek(5)
+                self.salt = f.read(self.salt_length)
+                if len(self.salt) != self.salt_length:
+                    raise ValueError('archive ended in the middle of header')
+        self.cypher = self.make_cypher()
         pass
 
+    def get_data_offset(self):
+        """data of the first file goes right after header"""
+        return 5 + len(self.salt)
+
+    def make_cypher(self):
+        if self.flags_handler.use_keystream_cypher:
+            return KeystreamCypherStream(self.derive_key(self.password, self.salt), self.salt)
+        return CypherStream(self.hash_password(self.password))
+
+    def derive_key(self, password: bytes | str, salt: bytes):
+        """key of keystream cypher; slow on purpose, against guessing passwords"""
+        if password is None:
+            return b''
+        if type(password) == str:
+            password = password.encode()
+        return hashlib.pbkdf2_hmac('sha256', password, salt, self.key_derivation_iterations)
+
     def hash_password(self, password: bytes | str):
+        """legacy cypher is seeded with 4 bytes"""
         if password is None:
             return 0
         if type(password) == str:
             password = password.encode()
         return hashlib.sha256(password).digest()[:4]
     pass
+
+
+def get_entropy_bits(data: bytes):
+    """order-0 entropy in bits per byte"""
+    if len(data) == 0:
+        return 0
+    return -sum(count / len(data) * math.log2(count / len(data)) for count in Counter(data).values())
+
+
+def compress_piece_job(engine: Engine, filepath, start):
+    """runs in worker process; returns whole compressed piece and state of profiler"""
+    piece = b''.join(engine.make_compressed_piece_stream(filepath, start))
+    return piece, get_profiler_state(engine)
+
+
+_shared_writing_limit = None
+
+
+def set_shared_writing_limit(writing_limit):
+    """initializer of worker processes"""
+    global _shared_writing_limit
+    _shared_writing_limit = writing_limit
+    pass
+
+
+def decompress_file_job(engine: Engine, file: FileInfo):
+    """runs in worker process; writes decompressed file,
+    returns error message or None and state of profiler"""
+    output_bytes_stream = engine.make_decompressed_file_stream(engine.src, file)
+    error = None
+    try:
+        with engine.profile_section('write', file.path):
+            file_handler.write_to_file_shared_limited(file.path, output_bytes_stream, _shared_writing_limit,
+                                                      strict=True)
+    except DECOMPRESSION_ERRORS as e:
+        file.path.unlink(missing_ok=True)
+        error = get_error_message(e)
+    return error, get_profiler_state(engine)
+
+
+def test_file_job(engine: Engine, file: FileInfo):
+    """runs in worker process; returns error message or None and state of profiler"""
+    return engine.test_file(file), get_profiler_state(engine)
+
+
+def get_error_message(error: Exception):
+    return f'{type(error).__name__}: {error}'
+
+
+def get_profiler_state(engine: Engine):
+    return None if engine.profiler is None else engine.profiler.get_state()
+
+
+def run_ordered(pool, tasks, ahead):
+    """yields results of tasks (function, *args) in order of tasks;
+    at most ahead tasks are submitted but not yielded yet"""
+    pending = deque()
+    for function, *args in tasks:
+        pending.append(pool.submit(function, *args))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+    pass
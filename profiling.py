@@ -0,0 +1,133 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+class StageStat:
+    """totals of one stage for one file"""
+    def __init__(self):
+        self.seconds = 0.0  # own time, without time of stages it reads from
+        self.calls = 0
+        self.items_out = 0
+        self.bytes_in = 0  # bytes it read from measured stages
+        self.bytes_out = 0
+        pass
+
+    def add(self, other):
+        self.seconds += other.seconds
+        self.calls += other.calls
+        self.items_out += other.items_out
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        pass
+    pass
+
+
+class Profiler:
+    """measures stages of fused generator pipelines
+    every next() of a wrapped stream is timed; time of wrapped streams it reads from
+    is subtracted, so every stage gets its own time only
+    keeps chrome trace events (chrome://tracing, ui.perfetto.dev)"""
+    def __init__(self):
+        self.stats = dict()  # (stage, file) -> StageStat
+        self.events = []
+        self.stack = []  # [stage, time of nested stages]
+        pass
+
+    def wrap(self, stage: str, stream, file=''):
+        """generator itself; yields items of stream"""
+        iterator = iter(stream)
+        stat = self.get_stat(stage, file)
+        while True:
+            with self.measure(stage, file):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            stat.items_out += 1
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                stat.bytes_out += len(item)
+                if len(self.stack) > 0:
+                    # stage that asked for item
+                    self.stack[-1][0].bytes_in += len(item)
+            yield item
+        pass
+
+    @contextmanager
+    def measure(self, stage: str, file=''):
+        """times a section as stage; returns its StageStat"""
+        stat = self.get_stat(stage, file)
+        self.stack.append([stat, 0.0])
+        start = time.perf_counter()
+        try:
+            yield stat
+        finally:
+            duration = time.perf_counter() - start
+            _, nested_seconds = self.stack.pop()
+            stat.seconds += duration - nested_seconds
+            stat.calls += 1
+            if len(self.stack) > 0:
+                self.stack[-1][1] += duration
+            self.events.append({'name': stage, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                                'ts': start * 1e6, 'dur': duration * 1e6, 'args': {'file': file}})
+        pass
+
+    def get_stat(self, stage: str, file=''):
+        key = (stage, file)
+        if key not in self.stats:
+            self.stats[key] = StageStat()
+        return self.stats[key]
+
+    def get_state(self):
+        """what is measured, to be sent from worker process"""
+        return self.stats, self.events
+
+    def merge(self, state):
+        """adds state of profiler of worker process"""
+        stats, events = state
+        for key, stat in stats.items():
+            self.get_stat(*key).add(stat)
+        self.events += events
+        pass
+
+    def get_stage_totals(self):
+        """stage -> StageStat of all files, in order of first use"""
+        totals = dict()
+        for (stage, _), stat in self.stats.items():
+            totals.setdefault(stage, StageStat()).add(stat)
+        return totals
+
+    def print_summary(self, output=None, file_rows=10):
+        """output: text stream, stdout by default"""
+        totals = self.get_stage_totals()
+        all_seconds = sum(stat.seconds for stat in totals.values()) or 1e-9
+        print(f'{"stage":<20}{"seconds":>10}{"share":>8}{"MB in":>10}{"MB out":>10}{"items out":>11}{"MB/s":>10}',
+              file=output)
+        for stage, stat in totals.items():
+            # first stage has no input, its speed is by output
+            speed = (stat.bytes_in or stat.bytes_out) / (1024 * 1024) / max(stat.seconds, 1e-9)
+            print(f'{stage:<20}{stat.seconds:>10.3f}{stat.seconds / all_seconds:>8.1%}'
+                  f'{stat.bytes_in / (1024 * 1024):>10.2f}{stat.bytes_out / (1024 * 1024):>10.2f}'
+                  f'{stat.items_out:>11}{speed:>10.2f}', file=output)
+        files = dict()
+        for (_, file), stat in self.stats.items():
+            files[file] = files.get(file, 0) + stat.seconds
+        print(f'\n{"file":<50}{"seconds":>10}', file=output)
+        for file, seconds in sorted(files.items(), key=lambda pair: -pair[1])[:file_rows]:
+            print(f'{file or "-":<50}{seconds:>10.3f}', file=output)
+        pass
+
+    def save_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        pass
+
+    def __getstate__(self):
+        """copies sent to worker processes start empty"""
+        return dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+        pass
+    pass
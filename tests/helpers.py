@@ -0,0 +1,91 @@
+import contextlib
+import io
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine import Engine
+
+
+REPOSITORY_FOLDER = Path(__file__).parent.parent
+DATA_FOLDER = REPOSITORY_FOLDER / 'data_files'
+SOURCE_FOLDER = DATA_FOLDER / 'source_data'
+
+
+def get_text(size=100 * 1024):
+    return (SOURCE_FOLDER / 'War_and_Peace.txt').read_bytes()[:size]
+
+
+def split_to_chunks(data, chunk_size=4096):
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def run_quietly(function, *args):
+    """engine prints messages to stdout"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def run_cli(*args, **options):
+    """runs main.py in a new process; returns subprocess.CompletedProcess"""
+    return subprocess.run([sys.executable, str(REPOSITORY_FOLDER / 'main.py'), *map(str, args)],
+                          capture_output=True, **options)
+
+
+def get_errors(results):
+    """results of decompress, extract or test: file name -> error message or None"""
+    return {('' if f is None else f.name): error for f, error in results}
+
+
+def assert_same_folders(test: unittest.TestCase, expected: Path, actual: Path):
+    expected_paths = sorted(p.relative_to(expected) for p in expected.rglob('*'))
+    test.assertEqual(expected_paths, sorted(p.relative_to(actual) for p in actual.rglob('*')))
+    for path in expected_paths:
+        if Path(expected, path).is_file():
+            test.assertEqual(Path(expected, path).read_bytes(), Path(actual, path).read_bytes(), str(path))
+    pass
+
+
+class ArchiveTestCase(unittest.TestCase):
+    """source folder in temporary folder:
+    text.txt, random.bin (stored), empty.txt, sub/fish.bmp, sub/empty/"""
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.source = Path(self.folder, 'source')
+        Path(self.source, 'sub', 'empty').mkdir(parents=True)
+        Path(self.source, 'text.txt').write_bytes(get_text(200 * 1024))
+        Path(self.source, 'random.bin').write_bytes(random.Random(6).randbytes(100 * 1024))
+        Path(self.source, 'empty.txt').write_bytes(b'')
+        shutil.copy(Path(SOURCE_FOLDER, 'fish.bmp'), Path(self.source, 'sub', 'fish.bmp'))
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        pass
+
+    def make_folder(self, name):
+        folder = Path(self.folder, name)
+        folder.mkdir()
+        return folder
+
+    def compress(self, name, **options):
+        """archive of source in new folder name"""
+        options.setdefault('writing_limit_megabytes', 100)
+        output = self.make_folder(name)
+        run_quietly(Engine(self.source, output, **options).compress)
+        return Path(output, 'source' + Engine.compressed_file_extension)
+
+    def decompress(self, archive, name, **options):
+        """decompresses into new folder name, all files must be fine; returns decompressed source"""
+        options.setdefault('writing_limit_megabytes', 100)
+        output = self.make_folder(name)
+        results = run_quietly(Engine(archive, output, **options).decompress)
+        self.assertEqual([], [(f, error) for f, error in results if error is not None])
+        return Path(output, 'source')
+    pass
@@ -0,0 +1,355 @@
+import json
+import os
+import struct
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from helpers import ArchiveTestCase, DATA_FOLDER, SOURCE_FOLDER, assert_same_folders, get_errors, get_text, \
+    run_cli, run_quietly
+from byte_level_algorithms.central_directory import MembersNotFoundError
+from byte_level_algorithms.file_handler import SharedWritingLimit
+from engine import Engine, FOOTER_MAGIC
+from profiling import Profiler
+
+
+# whole archives: new ones are round tripped, old ones in data_files/encoded
+# must still decode; run from repository root: python -m unittest discover tests
+
+
+class ArchiveTest(ArchiveTestCase):
+    def test_round_trip(self):
+        archive = self.compress('c')
+        assert_same_folders(self, self.source, self.decompress(archive, 'd'))
+        pass
+
+    def test_single_file(self):
+        archive_folder = self.make_folder('c')
+        run_quietly(Engine(Path(self.source, 'text.txt'), archive_folder).compress)
+        archive = Path(archive_folder, 'text' + Engine.compressed_file_extension)
+        output = self.decompress(archive, 'd').parent
+        self.assertEqual(Path(self.source, 'text.txt').read_bytes(), Path(output, 'text', 'text.txt').read_bytes())
+        pass
+
+    def test_incompressible_file_is_stored(self):
+        directory = Engine(self.compress('c')).read_central_directory()
+        self.assertTrue(directory.find('random.bin').is_stored)
+        self.assertFalse(directory.find('text.txt').is_stored)
+        self.assertEqual(100 * 1024, directory.find('random.bin').length_bytes)
+        pass
+
+    @unittest.skipIf(os.name == 'nt', '\\ and : are not parts of names on Windows')
+    def test_backslash_and_colon_in_names(self):
+        Path(self.source, 'a\\b.txt').write_bytes(b'a')
+        Path(self.source, 'sub', 'C:note').write_bytes(b'b')
+        archive = self.compress('c')
+        self.assertEqual([], [r for r in run_quietly(Engine(archive).test) if r[1] is not None])
+        assert_same_folders(self, self.source, self.decompress(archive, 'd'))
+        pass
+    pass
+
+
+class PipeTest(ArchiveTestCase):
+    def test_footer(self):
+        archive_bytes = self.compress('c').read_bytes()
+        self.assertEqual(0, struct.unpack('>I', archive_bytes[1:5])[0])
+        self.assertEqual(FOOTER_MAGIC, archive_bytes[-4:])
+        tree_pointer = struct.unpack('>Q', archive_bytes[-12:-4])[0]
+        tree_length = struct.unpack('>I', archive_bytes[tree_pointer:tree_pointer + 4])[0]
+        self.assertEqual(len(archive_bytes) - 12, tree_pointer + 4 + tree_length)
+        pass
+
+    def test_stdin_to_stdout(self):
+        data = Path(self.source, 'text.txt').read_bytes()
+        result = run_cli('-', 'c', '--use_lz77', input=data)
+        self.assertEqual(0, result.returncode, result.stderr)
+        archive = Path(self.folder, 'stdin' + Engine.compressed_file_extension)
+        archive.write_bytes(result.stdout)
+        output = self.make_folder('d')
+        self.assertEqual([], [r for r in run_quietly(Engine(archive, output).decompress) if r[1] is not None])
+        self.assertEqual(data, Path(output, 'stdin', 'stdin').read_bytes())
+        pass
+
+    def test_folder_to_stdout(self):
+        result = run_cli(self.source, 'c', '-dst', '-')
+        self.assertEqual(0, result.returncode, result.stderr)
+        # messages must not get into archive
+        self.assertIn(b'compressed', result.stderr)
+        archive = Path(self.folder, 'source' + Engine.compressed_file_extension)
+        archive.write_bytes(result.stdout)
+        assert_same_folders(self, self.source, self.decompress(archive, 'd'))
+        pass
+
+    def test_writing_limit(self):
+        """archive that does not fit is not written"""
+        output = self.make_folder('c')
+        result = run_cli(self.source, 'c', '-dst', output, '-wl', '0')
+        self.assertEqual(1, result.returncode)
+        self.assertEqual([], list(output.iterdir()))
+        result = run_cli('-', 'c', '-wl', '0', input=b'abc')
+        self.assertEqual(1, result.returncode)
+        pass
+    pass
+
+
+class PasswordTest(ArchiveTestCase):
+    def test_round_trip(self):
+        archive = self.compress('c', password='abc')
+        assert_same_folders(self, self.source, self.decompress(archive, 'd', password='abc'))
+        self.assertEqual([], [r for r in run_quietly(Engine(archive, password='abc').test) if r[1] is not None])
+        pass
+
+    def test_encrypted_data_is_compressed(self):
+        """cypher goes after compression and does not change its size"""
+        plain = self.compress('plain', use_lz77=True)
+        encrypted = self.compress('encrypted', use_lz77=True, password='abc')
+        self.assertEqual(plain.stat().st_size + Engine.salt_length, encrypted.stat().st_size)
+        assert_same_folders(self, self.source, self.decompress(encrypted, 'd', password='abc'))
+        pass
+
+    def test_random_salt(self):
+        self.assertNotEqual(self.compress('c1', password='abc').read_bytes()[:21],
+                            self.compress('c2', password='abc').read_bytes()[:21])
+        pass
+
+    def test_key_is_derived_once_with_salt_of_archive(self):
+        archive = self.compress('c', password='abc')
+        with mock.patch.object(Engine, 'derive_key', autospec=True, side_effect=Engine.derive_key) as derive_key:
+            engine = Engine(archive, self.make_folder('d'), password='abc', writing_limit_megabytes=100)
+            run_quietly(engine.decompress)
+        salt = archive.read_bytes()[5:5 + Engine.salt_length]
+        self.assertEqual([mock.call(engine, 'abc', salt)], derive_key.call_args_list)
+        pass
+    pass
+
+
+class FailedFilesTest(ArchiveTestCase):
+    """files that can not be decompressed are reported, not written"""
+    def test_writing_limit(self):
+        archive = self.compress('c')
+        for jobs in (1, 3):
+            with self.subTest(jobs=jobs):
+                output = self.make_folder(f'd{jobs}')
+                engine = Engine(archive, output, writing_limit_megabytes=0, jobs=jobs)
+                errors = get_errors(run_quietly(engine.decompress))
+                # empty file fits
+                self.assertIsNone(errors.pop('empty.txt'))
+                self.assertEqual(['fish.bmp', 'random.bin', 'text.txt'], sorted(errors))
+                self.assertTrue(all(error.startswith('WritingLimitError') for error in errors.values()))
+                self.assertEqual(['source/empty.txt'],
+                                 [p.relative_to(output).as_posix() for p in output.rglob('*') if p.is_file()])
+        result = run_cli(archive, 'd', '-dst', self.make_folder('cli'), '-wl', '0')
+        self.assertEqual(1, result.returncode)
+        self.assertIn(b'FAILED source/text.txt: WritingLimitError', result.stdout)
+        pass
+
+    def test_damaged_data(self):
+        archive = self.compress('c')
+        entry = Engine(archive).read_central_directory().find('text.txt')
+        data = bytearray(archive.read_bytes())
+        data[entry.start_position_bytes + entry.length_bytes // 2] ^= 1
+        archive.write_bytes(data)
+        errors = get_errors(run_quietly(Engine(archive).test))
+        self.assertIsNotNone(errors.pop('text.txt'))
+        self.assertEqual({None}, set(errors.values()))
+        output = self.make_folder('d')
+        errors = get_errors(run_quietly(Engine(archive, output, writing_limit_megabytes=100).decompress))
+        self.assertIsNotNone(errors.pop('text.txt'))
+        self.assertFalse(Path(output, 'source', 'text.txt').exists())
+        pass
+
+    def test_cut_archive(self):
+        archive = self.compress('c')
+        archive.write_bytes(archive.read_bytes()[:-100])
+        (file, error), = run_quietly(Engine(archive).test)
+        self.assertIsNone(file)
+        self.assertIsNotNone(error)
+        pass
+
+    def test_wrong_password(self):
+        archive = self.compress('c', password='abc')
+        errors = get_errors(run_quietly(Engine(archive, password='abd').test))
+        # empty file has nothing to check
+        self.assertIsNone(errors.pop('empty.txt'))
+        self.assertNotIn(None, errors.values())
+        pass
+
+    def test_damaged_directory(self):
+        """every entry is checked before anything is written"""
+        Path(self.source, 'aa_evil.txt').write_bytes(b'evil')
+        archive = self.compress('c')
+        data = archive.read_bytes()
+        directory_start = struct.unpack('>Q', data[-12:-4])[0] + 4
+        unsafe = data.replace(b'aa_evil.txt', b'../evil.txt')
+        # more records than there are
+        count_position = directory_start + 5
+        too_many = data[:count_position] + struct.pack('>I', 1000) + data[count_position + 4:]
+        for name, damaged in [('unsafe', unsafe), ('too_many', too_many)]:
+            archive.write_bytes(damaged)
+            output = self.make_folder(name)
+            for mode, args in [('decompress', ()), ('extract', (['*'],)), ('test', ())]:
+                with self.subTest(name=name, mode=mode):
+                    (file, error), = run_quietly(getattr(Engine(archive, output), mode), *args)
+                    self.assertIsNone(file)
+                    self.assertIsNotNone(error)
+            self.assertEqual([], list(self.folder.glob('evil.txt')) + list(output.iterdir()))
+        pass
+    pass
+
+
+class ParallelArchiveTest(ArchiveTestCase):
+    def test_jobs_give_same_archive(self):
+        """big files are cut into pieces, compressed in several processes"""
+        for options in [{}, {'use_lz77': True}]:
+            with self.subTest(**options):
+                name = '_lz77' if options else ''
+                serial = self.compress('serial' + name, piece_size_bytes=16 * 4096, **options)
+                parallel = self.compress('parallel' + name, piece_size_bytes=16 * 4096, jobs=3, **options)
+                self.assertEqual(serial.read_bytes(), parallel.read_bytes())
+                assert_same_folders(self, self.source, self.decompress(parallel, 'd' + name))
+        pass
+
+    def test_parallel_decompression(self):
+        archive = self.compress('c', use_lz77=True)
+        assert_same_folders(self, self.source, self.decompress(archive, 'd', jobs=3))
+        pass
+
+    def test_shared_writing_limit(self):
+        limit = SharedWritingLimit(1000)
+        with ProcessPoolExecutor(max_workers=3, initializer=set_worker_limit, initargs=(limit,)) as pool:
+            allowed = list(pool.map(take_from_limit, [300] * 6))
+        self.assertEqual(1000, sum(allowed))
+        self.assertEqual(0, limit.get_left())
+        limit = SharedWritingLimit(100)
+        self.assertEqual(0, limit.take(300, strict=True))
+        self.assertEqual(100, limit.get_left())
+        pass
+    pass
+
+
+_worker_limit = None
+
+
+def set_worker_limit(limit: SharedWritingLimit):
+    """initializer of worker processes; shared limit can be passed only at their start"""
+    global _worker_limit
+    _worker_limit = limit
+    pass
+
+
+def take_from_limit(n):
+    """runs in worker process"""
+    return _worker_limit.take(n)
+
+
+class ExtractTest(ArchiveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archive = self.compress('c')
+        pass
+
+    def extract(self, patterns, name):
+        """extracted files relative to new folder name"""
+        output = self.make_folder(name)
+        results = run_quietly(Engine(self.archive, output, writing_limit_megabytes=100).extract, patterns)
+        self.assertEqual([], [(f, error) for f, error in results if error is not None])
+        return sorted(p.relative_to(output).as_posix() for p in output.rglob('*') if p.is_file())
+
+    def test_patterns(self):
+        self.assertEqual(['source/sub/fish.bmp'], self.extract(['sub/fish.bmp'], 'file'))
+        self.assertEqual(['source/empty.txt', 'source/text.txt'], self.extract(['*.txt'], 'glob'))
+        self.assertEqual(['source/sub/fish.bmp'], self.extract(['sub'], 'folder'))
+        self.assertEqual(Path(self.source, 'sub', 'fish.bmp').read_bytes(),
+                         Path(self.folder, 'folder', 'source', 'sub', 'fish.bmp').read_bytes())
+        pass
+
+    def test_no_match(self):
+        # empty folder has no files
+        for i, patterns in enumerate([['missing'], ['*.png'], ['text.txt', 'sub/empty']]):
+            with self.subTest(patterns=patterns):
+                with self.assertRaises(MembersNotFoundError):
+                    self.extract(patterns, f'x{i}')
+        pass
+
+    def test_cli(self):
+        output = self.make_folder('cli')
+        result = run_cli(self.archive, 'x', 'sub', '-dst', output)
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertIn(b'extracted 1 files, 0 failed', result.stdout)
+        result = run_cli(self.archive, 'x', 'missing', '-dst', output)
+        self.assertEqual(1, result.returncode)
+        self.assertIn(b"'missing'", result.stderr)
+        pass
+    pass
+
+
+class ProfilerTest(ArchiveTestCase):
+    def test_stages_of_workers_are_merged(self):
+        profiler = Profiler()
+        self.compress('c', piece_size_bytes=16 * 4096, jobs=2, profiler=profiler)
+        files = {file for _, file in profiler.stats}
+        self.assertIn('sub/fish.bmp', files)
+        self.assertIn('text.txt', files)
+        # huffman coding runs only in worker processes; stream of every piece
+        # ends with a call that gives no item, text.txt has 4 pieces
+        stat = profiler.stats[('huffman_packing', 'text.txt')]
+        self.assertEqual(4, stat.calls - stat.items_out)
+        self.assertNotEqual({os.getpid()}, {event['pid'] for event in profiler.events})
+        trace = Path(self.folder, 'trace.json')
+        profiler.save_chrome_trace(trace)
+        self.assertEqual(len(profiler.events), len(json.loads(trace.read_text())['traceEvents']))
+        pass
+
+    def test_files_are_read_once(self):
+        """checksum is counted from data as it is compressed"""
+        profiler = Profiler()
+        self.compress('c', piece_size_bytes=16 * 4096, profiler=profiler)
+        self.assertEqual([], [key for key in profiler.stats if key[0] == 'checksum'])
+        for name in ['text.txt', 'random.bin']:
+            self.assertEqual(Path(self.source, name).stat().st_size, profiler.stats[('read', name)].bytes_out)
+        pass
+
+    def test_cli(self):
+        trace = Path(self.folder, 'trace.json')
+        result = run_cli(self.source, 'c', '-dst', self.make_folder('c'), '--profile', trace)
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertIn(b'huffman_packing', result.stdout)
+        self.assertIn('traceEvents', json.loads(trace.read_text()))
+        pass
+    pass
+
+
+class LegacyArchiveTest(unittest.TestCase):
+    """archives of old versions in data_files/encoded: pickled tree and old block format"""
+    def decompress(self, name):
+        with tempfile.TemporaryDirectory() as output:
+            engine = Engine(Path(DATA_FOLDER, 'encoded', name + Engine.compressed_file_extension), output,
+                            writing_limit_megabytes=100)
+            results = run_quietly(engine.decompress)
+            self.assertEqual([], [(f, error) for f, error in results if error is not None])
+            yield Path(output)
+        pass
+
+    def test_fish(self):
+        for output in self.decompress('fish'):
+            self.assertEqual(Path(SOURCE_FOLDER, 'fish.bmp').read_bytes(),
+                             Path(output, 'fish', 'fish.bmp').read_bytes())
+        pass
+
+    def test_subfolder(self):
+        for output in self.decompress('subfolder'):
+            assert_same_folders(self, Path(SOURCE_FOLDER, 'subfolder'), Path(output, 'subfolder'))
+        pass
+
+    def test_file_without_suffix(self):
+        """root name of archive is empty, file goes right into destination folder"""
+        for output in self.decompress('no_suffix'):
+            self.assertEqual(get_text(4096), Path(output, 'notes').read_bytes())
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import random
+import struct
+import unittest
+
+from helpers import get_text, split_to_chunks
+from byte_level_algorithms.canonical_huffman_bytes_converters import CanonicalHuffmanBlockToBytesConverter, \
+    BytesToCanonicalHuffmanBlockConverter
+from byte_level_algorithms.LZ77Record_to_bytes_converter import LZ77RecordToBytesConverter, \
+    LZ77VarintRecordToBytesConverter
+from byte_level_algorithms.central_directory import CentralDirectory, DirectoryEntry, IS_DIR_FLAG, \
+    IS_STORED_FLAG, RECORD_FORMATS, encode_central_directory, encode_path
+from core_algorithms.huffman_core import AdaptiveHuffmanEncoderCore, HuffmanDecoderCore, ChecksumError
+from core_algorithms.LZ77_core import LZ77EncoderCore, LZ77DecoderCore, PARSE_STRATEGIES
+from engine import Engine
+
+
+# encode -> decode of every format of archive data, so a change can not
+# silently break new or old archives; run from repository root:
+# python -m unittest discover tests
+
+
+class CanonicalHuffmanFormatTest(unittest.TestCase):
+    def encode(self, data, use_checksums=False):
+        blocks = AdaptiveHuffmanEncoderCore(4096, max_block_length=64 * 1024).encode(split_to_chunks(data))
+        return b''.join(CanonicalHuffmanBlockToBytesConverter(use_checksums=use_checksums).encode(blocks))
+
+    def decode(self, encoded, use_checksums=False):
+        blocks = BytesToCanonicalHuffmanBlockConverter(use_checksums=use_checksums).decode(
+            split_to_chunks(encoded, 1000))
+        return b''.join(HuffmanDecoderCore().decode(blocks))
+
+    def test_round_trip(self):
+        data = get_text() + random.Random(1).randbytes(20 * 1024) + bytes(10 * 1024)
+        encoded = self.encode(data)
+        self.assertLess(len(encoded), len(data))
+        self.assertEqual(data, self.decode(encoded))
+        pass
+
+    def test_checksums(self):
+        data = get_text()
+        encoded = self.encode(data, use_checksums=True)
+        self.assertEqual(data, self.decode(encoded, use_checksums=True))
+        damaged = bytearray(encoded)
+        damaged[-1] ^= 1
+        with self.assertRaises(ChecksumError):
+            self.decode(damaged, use_checksums=True)
+        pass
+
+    def test_stored_block(self):
+        data = random.Random(2).randbytes(8 * 1024)
+        encoded = self.encode(data)
+        # type, items count, items
+        self.assertEqual(1 + 4 + len(data), len(encoded))
+        self.assertEqual(data, self.decode(encoded))
+        pass
+
+    def test_one_item(self):
+        data = b'a' * 5000
+        self.assertEqual(data, self.decode(self.encode(data)))
+        pass
+
+    def test_empty(self):
+        self.assertEqual(b'', self.decode(self.encode(b'')))
+        pass
+    pass
+
+
+class LZ77FormatTest(unittest.TestCase):
+    def round_trip(self, data, converter, window_width, max_length, parse='greedy'):
+        records = LZ77EncoderCore(window_width, max_length, parse=parse).encode(split_to_chunks(data))
+        encoded = b''.join(converter.encode(records))
+        decoded = b''.join(LZ77DecoderCore(window_width).decode(converter.decode(split_to_chunks(encoded, 777))))
+        self.assertEqual(data, decoded)
+        return encoded
+
+    def test_one_byte_records(self):
+        data = get_text(30 * 1024) + bytes(1000)
+        self.round_trip(data, LZ77RecordToBytesConverter(), 255, 255)
+        pass
+
+    def test_varint_records(self):
+        data = get_text(30 * 1024) + bytes(1000) + random.Random(3).randbytes(3000)
+        encoded = self.round_trip(data, LZ77VarintRecordToBytesConverter(),
+                                  Engine.lz77_window_width, Engine.lz77_max_length)
+        self.assertLess(len(encoded), len(data))
+        pass
+
+    def test_parse_strategies(self):
+        data = get_text(30 * 1024) + bytes(1000) + random.Random(3).randbytes(3000)
+        sizes = dict()
+        for parse in PARSE_STRATEGIES:
+            with self.subTest(parse=parse):
+                sizes[parse] = len(self.round_trip(data, LZ77VarintRecordToBytesConverter(),
+                                                   Engine.lz77_window_width, Engine.lz77_max_length, parse))
+        self.assertLessEqual(sizes['optimal'], sizes['greedy'])
+        pass
+
+    def test_long_match_far_back(self):
+        part = random.Random(4).randbytes(1000)
+        data = part + random.Random(5).randbytes(20 * 1024) + part
+        encoded = self.round_trip(data, LZ77VarintRecordToBytesConverter(),
+                                  Engine.lz77_window_width, Engine.lz77_max_length)
+        self.assertLess(len(encoded), len(data) - 900)
+        pass
+
+    def test_cut_sequence(self):
+        with self.assertRaises(ValueError):
+            list(LZ77VarintRecordToBytesConverter().decode([b'\x05ab']))
+        pass
+    pass
+
+
+class CentralDirectoryFormatTest(unittest.TestCase):
+    entries = [DirectoryEntry('b.txt', 5, 10, 20, 0, 1234),
+               DirectoryEntry('a', flags=IS_DIR_FLAG),
+               DirectoryEntry('a/c.png', 15, 30, 30, IS_STORED_FLAG, 0),
+               DirectoryEntry('a b/ü.txt', 45, 0, 0, 0, None)]
+
+    def test_round_trip(self):
+        directory = CentralDirectory(encode_central_directory('root', self.entries))
+        self.assertEqual('root', directory.root_name)
+        # directory goes right before its content
+        self.assertEqual(['a', 'a/c.png', 'a b/ü.txt', 'b.txt'], [e.path for e in directory])
+        entry = directory.find('a/c.png')
+        self.assertEqual((15, 30, 30, 0), (entry.start_position_bytes, entry.length_bytes,
+                                           entry.initial_size, entry.checksum))
+        self.assertTrue(entry.is_stored)
+        self.assertTrue(directory.find('a').is_dir)
+        self.assertEqual(1234, directory.find('b.txt').checksum)
+        self.assertIsNone(directory.find('a b/ü.txt').checksum)
+        self.assertIsNone(directory.find('missing'))
+        pass
+
+    def test_version_1(self):
+        """records without checksum"""
+        root_name = b'root'
+        path = encode_path('x/y.txt')
+        version_1 = b''.join([struct.pack('>4sBIH', b'DFDR', 1, 1, len(root_name)), root_name,
+                              struct.pack(RECORD_FORMATS[1], 0, len(path), 5, 7, 9, 0), path])
+        entry = CentralDirectory(version_1).find('x/y.txt')
+        self.assertEqual((5, 7, 9, None), (entry.start_position_bytes, entry.length_bytes,
+                                           entry.initial_size, entry.checksum))
+        pass
+
+    def test_unsafe_paths(self):
+        unsafe = [('/tmp', 'a'), ('..', 'a'), ('', 'a'), ('root', '../a'), ('root', '/a'), ('root', 'a//b')]
+        if os.name == 'nt':
+            unsafe += [('C:', 'a'), ('root', 'C:a'), ('root', 'a\\b')]
+        for root_name, path in unsafe:
+            with self.subTest(root_name=root_name, path=path):
+                with self.assertRaises(ValueError):
+                    list(CentralDirectory(encode_central_directory(root_name, [DirectoryEntry(path)])))
+        pass
+
+    @unittest.skipIf(os.name == 'nt', '\\ and : are not parts of names on Windows')
+    def test_usual_names_outside_of_windows(self):
+        paths = ['C:note', 'a\\b.txt']
+        directory = CentralDirectory(encode_central_directory('C:root', [DirectoryEntry(p) for p in paths]))
+        self.assertEqual(paths, [e.path for e in directory])
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()